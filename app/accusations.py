@@ -0,0 +1,73 @@
+import threading
+
+from app.cache import TTLCache
+from app.scheduler import to_epoch
+
+
+class OpenAccusations:
+    """
+    The latest open (not yet judged) accusation in each channel, and who has voted on
+    each accusation, as far as this process knows. Kept current from the results of
+    the accusation RPCs, so /liar can answer "nothing to refute" and /judge can turn
+    away repeat voters without a database call. Entries expire to pick up accusations
+    and votes made by other processes.
+
+    Vote counts are not kept here: close_accusation tallies the votes server-side,
+    under the accusation's row lock, in the same call that records the verdict.
+    """
+
+    def __init__(self, ttl=60, max_size=1024):
+        self._latest = TTLCache(max_size, ttl)
+        self._voters = TTLCache(max_size, ttl)
+        self._lock = threading.Lock()
+
+    def latest(self, channel_id, since):
+        """
+        Returns (known, accusation): whether the channel's latest open accusation is
+        known, and that accusation if it was made at or after the ISO timestamp `since`.
+        """
+        entry = self._latest.get(channel_id)
+        if entry is None:
+            return False, None
+        accusation = entry["accusation"]
+        if accusation is not None and to_epoch(accusation["timestamp"]) < to_epoch(since):
+            accusation = None
+        return True, accusation
+
+    def opened(self, accusation):
+        """
+        Record a new accusation, which is now the latest open one in its channel.
+        """
+        self._latest.set(accusation["channel_id"], {"accusation": accusation})
+
+    def refuted(self, channel_id, accusation):
+        """
+        Record the result of refute_latest_accusation: the channel's latest open
+        accusation, or None when it has none.
+        """
+        self._latest.set(channel_id, {"accusation": accusation})
+
+    def closed(self, accusation_id, channel_id):
+        """
+        Forget a judged accusation. An older one may still be open in the channel,
+        so the channel becomes unknown rather than empty.
+        """
+        with self._lock:
+            entry = self._latest.get(channel_id)
+            if entry is not None and entry["accusation"] is not None and entry["accusation"]["id"] == accusation_id:
+                self._latest.invalidate(channel_id)
+
+    def has_voted(self, accusation_id, voter_id):
+        voters = self._voters.get(accusation_id)
+        return voters is not None and voter_id in voters
+
+    def voted(self, accusation_id, voter_id):
+        with self._lock:
+            voters = self._voters.get(accusation_id)
+            if voters is None:
+                voters = set()
+                self._voters.set(accusation_id, voters)
+            voters.add(voter_id)
+
+
+open_accusations = OpenAccusations()
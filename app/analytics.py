@@ -0,0 +1,270 @@
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.config import SUPPLY_ALERT_DAYS
+from app.export import iter_pages
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# Pots per day are averaged over this many recent days when forecasting
+RECENT_DAYS = 28
+
+# Forecasts only look this far back
+HISTORY_DAYS = 365
+
+# A last cup more than this many seconds after the previous brew is not paired with it
+MAX_POT_LIFETIME = 24 * 3600
+
+
+def _times(values):
+    return np.array(values, dtype="datetime64[us]").astype("datetime64[s]")
+
+
+def _by_time(rows, *columns):
+    """
+    A time column plus the named columns, as arrays sorted by time.
+    """
+    times = _times([row["timestamp"] for row in rows])
+    order = np.argsort(times, kind="stable")
+    values = (np.array([row[column] if row[column] is not None else "" for row in rows], dtype=object)
+              for column in columns)
+    return (times[order],) + tuple(column[order] for column in values)
+
+
+class ActivityHistory:
+    """
+    Brew, last-cup and restock history held as columnar NumPy arrays, each sorted by
+    time, so the statistics below are whole-array operations rather than row loops.
+    """
+
+    def __init__(self, brews, cups, restocks):
+        self.brew_times, brew_channels = _by_time(brews, "channel")
+        self.cup_times, cup_channels = _by_time(cups, "channel_id")
+        self.restock_times, items, quantities = _by_time(restocks, "item", "quantity")
+        self.restock_items = np.char.lower(items.astype(str))
+        self.restock_quantities = quantities.astype(np.int64)
+
+        # Channels as integer codes into self.channels, which compare far faster than strings
+        self.channels, codes = np.unique(np.concatenate([brew_channels, cup_channels]).astype(str), return_inverse=True)
+        self.brew_channels, self.cup_channels = codes[:len(brew_channels)], codes[len(brew_channels):]
+
+    @classmethod
+    def load(cls, since=None):
+        """
+        Read the three log tables from the store a page at a time.
+        """
+        def rows(table):
+            return [row for page in iter_pages(table, since=since) for row in page]
+
+        return cls(rows("brewing_logs"), rows("last_cup_logs"), rows("restock_logs"))
+
+    def channel_code(self, channel):
+        index = np.searchsorted(self.channels, channel)
+        return index if index < len(self.channels) and self.channels[index] == channel else -1
+
+    def brews(self, channel=None):
+        if channel is None:
+            return self.brew_times
+        return self.brew_times[self.brew_channels == self.channel_code(channel)]
+
+
+def pots_by_weekday_hour(history, channel=None):
+    """
+    Average pots brewed in each hour of each weekday (UTC), as a 7 x 24 array
+    with Monday first.
+    """
+    times = history.brews(channel)
+    if not len(times):
+        return np.zeros((7, 24))
+
+    seconds = times.astype(np.int64)
+    days = seconds // 86400
+    # 1970-01-01 was a Thursday
+    slots = ((days + 3) % 7) * 24 + (seconds // 3600) % 24
+    counts = np.bincount(slots, minlength=7 * 24).reshape(7, 24)
+
+    weeks = max(1.0, (days[-1] - days[0] + 1) / 7)
+    return counts / weeks
+
+
+def brew_to_last_cup(history, channel=None):
+    """
+    Minutes from a brew to the last cup of that pot. Each last cup is paired with
+    the most recent brew before it in the same channel.
+    """
+    brew_codes, brew_seconds = history.brew_channels, history.brew_times.astype(np.int64)
+    cup_codes, cup_seconds = history.cup_channels, history.cup_times.astype(np.int64)
+    if channel is not None:
+        code = history.channel_code(channel)
+        brew_seconds, brew_codes = brew_seconds[brew_codes == code], brew_codes[brew_codes == code]
+        cup_seconds, cup_codes = cup_seconds[cup_codes == code], cup_codes[cup_codes == code]
+
+    # Sorting on (channel, time) packed into one integer pairs every channel in a single search
+    brew_keys = np.sort((brew_codes.astype(np.int64) << 32) | brew_seconds)
+    previous = np.searchsorted(brew_keys, (cup_codes.astype(np.int64) << 32) | cup_seconds, side="right") - 1
+    paired = previous >= 0
+    paired[paired] = (brew_keys[previous[paired]] >> 32) == cup_codes[paired]
+
+    gaps = cup_seconds[paired] - (brew_keys[previous[paired]] & 0xFFFFFFFF)
+    minutes = gaps[gaps <= MAX_POT_LIFETIME] / 60
+    if not len(minutes):
+        return {"pots": 0, "mean_minutes": None, "median_minutes": None}
+    return {
+        "pots": int(len(minutes)),
+        "mean_minutes": round(float(minutes.mean()), 1),
+        "median_minutes": round(float(np.median(minutes)), 1),
+    }
+
+
+def pots_per_day(history, now, days=RECENT_DAYS):
+    brews = history.brew_times
+    start = np.datetime64(now - timedelta(days=days), "s")
+    return int(len(brews) - np.searchsorted(brews, start)) / days
+
+
+def burn_rates(history, now=None):
+    """
+    Per-item consumption and a run-out forecast from the restock log.
+
+    Everything restocked before an item's latest restock is taken as used up by
+    then, so usage per pot is that quantity over the pots brewed in between. What
+    remains of the latest restock is its quantity less the usage of the pots brewed
+    since, and it runs out at the recent brewing rate.
+    """
+    now = now or datetime.utcnow()
+    times, quantities = history.restock_times, history.restock_quantities
+    if not len(times):
+        return {}
+
+    items, index = np.unique(history.restock_items, return_inverse=True)
+    positions = np.arange(len(times))
+
+    first = np.full(len(items), len(times))
+    np.minimum.at(first, index, positions)
+    last = np.full(len(items), -1)
+    np.maximum.at(last, index, positions)
+
+    total = np.bincount(index, weights=quantities, minlength=len(items))
+    used = total - quantities[last]
+
+    brews = history.brew_times
+    pots_before = np.searchsorted(brews, times, side="left")
+    now_pot = np.searchsorted(brews, np.datetime64(now, "s"), side="right")
+    pots_between = pots_before[last] - pots_before[first]
+    pots_since = now_pot - pots_before[last]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        per_pot = np.where(pots_between > 0, used / pots_between, np.nan)
+    remaining = np.maximum(quantities[last] - np.nan_to_num(per_pot) * pots_since, 0)
+
+    daily_pots = pots_per_day(history, now)
+    rates = {}
+    for item, rate, left, restocked in zip(items, per_pot, remaining, times[last]):
+        known = not np.isnan(rate)
+        per_day = rate * daily_pots if known else None
+        rates[str(item)] = {
+            "per_pot": round(float(rate), 3) if known else None,
+            "per_day": round(float(per_day), 2) if known else None,
+            "remaining": round(float(left), 1),
+            "last_restock": restocked.astype(datetime),
+            "runs_out": now + timedelta(days=float(left / per_day)) if known and per_day else None,
+        }
+    return rates
+
+
+class SupplyForecaster:
+    """
+    Keeps a loaded ActivityHistory for `ttl` seconds and reports items forecast to
+    run out within `alert_days`, each at most once per day.
+    """
+
+    def __init__(self, alert_days, ttl=3600, load=None):
+        self.alert_days = alert_days
+        self.ttl = ttl
+        self.load = load or (lambda: ActivityHistory.load((datetime.utcnow() - timedelta(days=HISTORY_DAYS)).date().isoformat()))
+        self._history = None
+        self._loaded_at = None
+        self._alerted = set()
+        self._lock = threading.Lock()
+
+    def history(self):
+        with self._lock:
+            now = datetime.utcnow()
+            if self._history is None or (now - self._loaded_at).total_seconds() > self.ttl:
+                self._history = self.load()
+                self._loaded_at = now
+            return self._history
+
+    def invalidate(self):
+        with self._lock:
+            self._history = None
+
+    def due_alerts(self, now=None):
+        """
+        Return [(item, forecast)] for items running out soon that have not been
+        announced today.
+        """
+        now = now or datetime.utcnow()
+        horizon = now + timedelta(days=self.alert_days)
+        self._alerted = {(item, day) for item, day in self._alerted if day == now.date()}
+        due = []
+        for item, forecast in burn_rates(self.history(), now).items():
+            runs_out = forecast["runs_out"]
+            if runs_out is None or runs_out > horizon or (item, now.date()) in self._alerted:
+                continue
+            self._alerted.add((item, now.date()))
+            due.append((item, forecast))
+        return due
+
+
+supply_forecaster = SupplyForecaster(SUPPLY_ALERT_DAYS)
+
+
+def supply_message(item, forecast, now=None):
+    now = now or datetime.utcnow()
+    days = (forecast["runs_out"] - now).total_seconds() / 86400
+    when = "today" if days < 1 else f"in about {round(days)} day{'s' if round(days) != 1 else ''}"
+    return f"🛒 We're running low on {item}: at the current rate it runs out {when}. Time for a /restock!"
+
+
+def report(history, now=None):
+    now = now or datetime.utcnow()
+    lines = []
+
+    lines.append(f"Brews: {len(history.brew_times)}, {pots_per_day(history, now):.1f} pots/day over the last {RECENT_DAYS} days")
+    if len(history.brew_times):
+        pots = pots_by_weekday_hour(history)
+        day, hour = np.unravel_index(np.argmax(pots), pots.shape)
+        lines.append(f"Busiest slot: {WEEKDAYS[day]} {hour:02d}:00 UTC, {pots[day, hour]:.2f} pots/week")
+        lines.append("Pots per weekday: " + ", ".join(f"{name[:3]} {count:.1f}" for name, count in zip(WEEKDAYS, pots.sum(axis=1))))
+
+    lifetime = brew_to_last_cup(history)
+    if lifetime["pots"]:
+        lines.append(f"Brew to last cup: {lifetime['mean_minutes']} min mean, {lifetime['median_minutes']} min median "
+                     f"over {lifetime['pots']} pots")
+
+    for item, forecast in burn_rates(history, now).items():
+        if forecast["per_pot"] is None:
+            lines.append(f"{item}: {forecast['remaining']:g} left, not enough restocks to estimate usage")
+            continue
+        runs_out = forecast["runs_out"].strftime("%Y-%m-%d") if forecast["runs_out"] else "not at the current rate"
+        lines.append(f"{item}: {forecast['per_pot']} per pot, {forecast['per_day']} per day, "
+                     f"~{forecast['remaining']:g} left, runs out {runs_out}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(prog="python -m app.analytics", description="Coffee consumption report.")
+    parser.add_argument("--since", help="only use history from this day, YYYY-MM-DD")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    history = ActivityHistory.load(args.since)
+    loaded = time.perf_counter()
+    print(report(history))
+    print(f"\nLoaded in {loaded - started:.2f}s, analysed in {(time.perf_counter() - loaded) * 1000:.1f}ms")
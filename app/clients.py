@@ -0,0 +1,66 @@
+import threading
+import time
+
+from app.config import SUPABASE_URL, SUPABASE_SERVICE_KEY, SUPABASE_TIMEOUT
+from app.metrics import metrics
+
+_supabase = None
+_supabase_lock = threading.Lock()
+
+
+def get_supabase():
+    """
+    The process-wide Supabase client, created on first use. The supabase package and
+    its HTTP stack are only imported then, keeping them off the cold-start path.
+    """
+    global _supabase
+    if _supabase is None:
+        with _supabase_lock:
+            if _supabase is None:
+                from supabase import ClientOptions, create_client
+                client = create_client(
+                    SUPABASE_URL, SUPABASE_SERVICE_KEY, ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT)
+                )
+                instrument_postgrest(client.postgrest.session)
+                _supabase = client
+    return _supabase
+
+
+def _start_span(request):
+    request.extensions["metrics_started"] = time.perf_counter()
+
+
+def _end_span(response):
+    request = response.request
+    started = request.extensions.get("metrics_started")
+    if started is None:
+        return
+
+    # /rest/v1/<table> or /rest/v1/rpc/<function>
+    operation = request.url.path.split("/rest/v1/", 1)[-1]
+    span = {"dependency": "supabase", "operation": f"{request.method} {operation}", "error": response.status_code >= 400}
+    metrics.record_span(span, time.perf_counter() - started)
+
+
+def instrument_postgrest(session):
+    """
+    Time every PostgREST query made through a Supabase client's HTTP session.
+    """
+    session.event_hooks["request"].append(_start_span)
+    session.event_hooks["response"].append(_end_span)
+
+
+class LazyClient:
+    """
+    Stands in for a client until it is first used, then forwards every attribute
+    to the instance returned by `factory()`.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+
+supabase = LazyClient(get_supabase)
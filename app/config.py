@@ -6,7 +6,60 @@ load_dotenv()
 
 SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")
 SIGNING_SECRET = os.getenv("SIGNING_SECRET")
+# Without SIGNING_SECRET every Slack request is refused; set this to 1 to accept them unverified (local testing only)
+SKIP_SLACK_VERIFICATION = os.getenv("SKIP_SLACK_VERIFICATION") == "1"
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+# Where the bot keeps its data: "supabase", or "sqlite" for a local database file at SQLITE_PATH
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "coffee-bot.db")
 EDGE_FUNCTION_URL = os.getenv("EDGE_FUNCTION_URL")
 COFFEE_CHANNEL_ID = os.getenv("COFFEE_CHANNEL_ID")
+SLACK_API_URL = os.getenv("SLACK_API_URL", "https://slack.com/api")
+# Set to "off" only when pointing SLACK_API_URL at a local stub server
+SLACK_RATE_LIMITING = os.getenv("SLACK_RATE_LIMITING", "on") != "off"
+
+# Seconds before a Supabase query or Slack API call is given up on
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "5"))
+SLACK_TIMEOUT = float(os.getenv("SLACK_TIMEOUT", "10"))
+# A dependency's circuit opens after this many failed calls in a row, failing fast for BREAKER_RESET_SECONDS
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# Background threads (the deferred command pool, the follow-up scheduler, the write buffer and the outbox)
+# need a long-lived process. Serverless platforms freeze a function between requests, so with this set to 0
+# commands run inline, rows are inserted and messages sent as they happen, and the process_brewing_jobs
+# cron job sends the follow-ups. Defaults to 0 on Vercel.
+BACKGROUND_WORKERS = os.getenv("BACKGROUND_WORKERS", "0" if os.getenv("VERCEL") else "1") == "1"
+
+# Slash-command bodies run on a bounded worker pool after Slack is acknowledged.
+# The queue size and worker share are per tenant (coffee channel).
+DEFERRED_WORKERS = int(os.getenv("DEFERRED_WORKERS", "8"))
+DEFERRED_QUEUE_SIZE = int(os.getenv("DEFERRED_QUEUE_SIZE", "100"))
+DEFERRED_WORKERS_PER_TENANT = int(os.getenv("DEFERRED_WORKERS_PER_TENANT", str(max(1, DEFERRED_WORKERS // 2))))
+
+# How /pick-brewer chooses: uniform, least_recent or deficit
+BREWER_SELECTION_STRATEGY = os.getenv("BREWER_SELECTION_STRATEGY", "uniform")
+
+# Log inserts are buffered in an append-only spool and flushed in bulk. Each process spools to
+# WRITE_SPOOL_PATH.<pid>; rows that keep failing to insert are moved to WRITE_SPOOL_PATH.dead.jsonl
+WRITE_SPOOL_PATH = os.getenv("WRITE_SPOOL_PATH", "/tmp/coffee-bot-writes.jsonl")
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "50"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "1.0"))
+
+# Minutes between /brew and the "coffee is ready" follow-up
+COFFEE_READY_DELAY_MINUTES = int(os.getenv("COFFEE_READY_DELAY_MINUTES", "10"))
+
+# Channel messages queued within this many seconds are merged into one post
+OUTBOX_WINDOW_SECONDS = float(os.getenv("OUTBOX_WINDOW_SECONDS", "1.0"))
+# Threads sending channel messages; each channel is sent by one thread at a time
+OUTBOX_SENDERS = int(os.getenv("OUTBOX_SENDERS", "4"))
+
+# After a /brew, warn the channel about supplies forecast to run out within this many days (0 = off, needs numpy)
+SUPPLY_ALERT_DAYS = float(os.getenv("SUPPLY_ALERT_DAYS", "0"))
+
+# Bearer token required to scrape /metrics; leave unset to serve it openly
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Bearer token required for /export; the endpoint is disabled while it is unset
+EXPORT_TOKEN = os.getenv("EXPORT_TOKEN")
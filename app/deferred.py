@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from app.config import BACKGROUND_WORKERS, DEFERRED_WORKERS, DEFERRED_QUEUE_SIZE, DEFERRED_WORKERS_PER_TENANT
+from app.metrics import metrics, record_request
+from app.resilience import CircuitOpenError, unavailable_payload
+from app.slack_client import slack
+
+ACK_TEXT = "⏳ Working on it..."
+BUSY_TEXT = "☕ The coffee bot is busy right now, please try again in a moment."
+
+
+class DeferredExecutor:
+    """
+    A bounded pool of worker threads that runs slash-command bodies after Slack has
+    already been acknowledged. Each tenant has its own queue of up to `max_queue` jobs.
+    Workers serve the tenants in turn, and a tenant holding `max_per_tenant` workers only
+    gets another one when no other tenant is waiting, so one busy floor cannot starve the others.
+    """
+
+    def __init__(self, max_workers, max_queue, max_per_tenant=None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_per_tenant = max_per_tenant or max_workers
+        self._queues = OrderedDict()  # tenant -> pending jobs, in round-robin order
+        self._running = {}
+        self._condition = threading.Condition()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            while len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._run, daemon=True, name=f"deferred-{len(self._workers)}")
+                worker.start()
+                self._workers.append(worker)
+
+    def _next(self):
+        """
+        Block until a job is queued and take it. Tenants are served in turn, skipping those
+        already at their worker limit unless no other tenant has anything queued.
+        """
+        with self._condition:
+            while not self._queues:
+                self._condition.wait()
+
+            tenant = next(
+                (tenant for tenant in self._queues if self._running.get(tenant, 0) < self.max_per_tenant),
+                next(iter(self._queues))
+            )
+            jobs = self._queues[tenant]
+            job = jobs.popleft()
+            if jobs:
+                self._queues.move_to_end(tenant)
+            else:
+                del self._queues[tenant]
+            self._running[tenant] = self._running.get(tenant, 0) + 1
+            return tenant, job
+
+    def _run(self):
+        while True:
+            tenant, (job, args) = self._next()
+            try:
+                job(*args)
+            except Exception as e:
+                print(f"Deferred job failed: {e}")
+            finally:
+                with self._condition:
+                    self._running[tenant] -= 1
+                    if not self._running[tenant]:
+                        del self._running[tenant]
+
+    def submit(self, job, *args, tenant=None):
+        """
+        Queue a job for a worker. Returns False when the tenant's queue is full.
+        """
+        if len(self._workers) < self.max_workers:
+            self._start()
+
+        with self._condition:
+            jobs = self._queues.get(tenant)
+            if jobs is None:
+                jobs = self._queues[tenant] = deque()
+            if len(jobs) >= self.max_queue:
+                return False
+            jobs.append((job, args))
+            self._condition.notify()
+        return True
+
+    def queue_depth(self, tenant=None):
+        with self._condition:
+            if tenant is not None:
+                return len(self._queues.get(tenant, ()))
+            return sum(map(len, self._queues.values()))
+
+
+executor = DeferredExecutor(DEFERRED_WORKERS, DEFERRED_QUEUE_SIZE, DEFERRED_WORKERS_PER_TENANT)
+
+
+def respond(response_url, payload):
+    """
+    Delivers a command result to Slack through the command's response_url.
+    """
+    try:
+        response = slack.post_response(response_url, payload)
+    except Exception as e:
+        print(f"Failed to deliver deferred response: {e}")
+        return
+
+    if not response.ok:
+        print(f"Failed to deliver deferred response: {response.text}")
+
+
+def _run_and_respond(command, response_url, work):
+    started = time.perf_counter()
+    status = 200
+    with metrics.collect() as spans:
+        try:
+            payload = work()
+        except CircuitOpenError as e:
+            payload, status = unavailable_payload(e), 503
+        except Exception as e:
+            print(f"Deferred command failed: {e}")
+            payload = {"response_type": "ephemeral", "text": f"❌ Error: {str(e)}"}
+            status = 500
+
+        respond(response_url, payload)
+    record_request(f"deferred:{command}", status, time.perf_counter() - started, spans)
+
+
+def defer_command(data, work, ack_text=ACK_TEXT, tenant_key=None):
+    """
+    Acknowledges a slash command immediately and runs `work` on the worker pool.
+    The dict `work` returns is posted back to the command's response_url.
+    Requests without a response_url, and every request when BACKGROUND_WORKERS is
+    off, are handled inline. Commands are queued per
+    `tenant_key`, so each coffee channel gets its share of the workers.
+    """
+    response_url = data.get("response_url")
+    if not response_url or not BACKGROUND_WORKERS:
+        try:
+            return work()
+        except CircuitOpenError as e:
+            return unavailable_payload(e)
+
+    if not executor.submit(
+        _run_and_respond, data.get("command", "unknown"), response_url, work, tenant=tenant_key
+    ):
+        return {"response_type": "ephemeral", "text": BUSY_TEXT}
+
+    return {"response_type": "ephemeral", "text": ack_text}
@@ -0,0 +1,226 @@
+import csv
+import io
+from datetime import datetime
+
+from app.storage import store
+
+EXPORT_PAGE_SIZE = 1000
+
+# Exportable tables, their columns (with a type for columnar output) and their channel column
+EXPORT_TABLES = {
+    "brewing_logs": {
+        "columns": {"id": "string", "user_id": "string", "user_name": "string", "channel": "string",
+                    "timestamp": "timestamp"},
+        "channel": "channel",
+    },
+    "restock_logs": {
+        "columns": {"id": "string", "user_id": "string", "user_name": "string", "item": "string",
+                    "quantity": "int", "points": "int", "timestamp": "timestamp"},
+        "channel": None,
+    },
+    "last_cup_logs": {
+        "columns": {"id": "string", "user_id": "string", "user_name": "string", "channel_id": "string",
+                    "timestamp": "timestamp"},
+        "channel": "channel_id",
+    },
+    "accusations": {
+        "columns": {"id": "string", "accuser_id": "string", "accuser_name": "string", "accused_id": "string",
+                    "accused_name": "string", "channel_id": "string", "timestamp": "timestamp",
+                    "refuted": "bool", "judged": "bool"},
+        "channel": "channel_id",
+    },
+    "votes": {
+        "columns": {"id": "int", "accusation_id": "string", "voter_id": "string", "voter_name": "string",
+                    "vote": "string", "timestamp": "timestamp"},
+        "channel": None,
+    },
+}
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def parse_bound(value):
+    """
+    Accepts a date or datetime in ISO format and returns it as a PostgREST timestamp.
+    """
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid date {value!r}, expected YYYY-MM-DD or an ISO timestamp")
+
+
+def export_spec(table, channel=None):
+    """
+    Look up an exportable table, checking that it can be filtered as asked.
+    """
+    spec = EXPORT_TABLES.get(table)
+    if spec is None:
+        raise ValueError(f"Unknown table {table!r}. Options are: {', '.join(EXPORT_TABLES)}")
+    if channel and spec["channel"] is None:
+        raise ValueError(f"{table} has no channel column to filter on")
+    return spec
+
+
+def iter_pages(table, since=None, until=None, channel=None, page_size=EXPORT_PAGE_SIZE):
+    """
+    Yield the rows of a table in (timestamp, id) order, one page at a time. Each page
+    continues after the last row of the one before (keyset pagination), so deep pages
+    cost the same as the first and only one page is held in memory.
+    """
+    spec = export_spec(table, channel)
+    since, until = parse_bound(since), parse_bound(until)
+    last = None
+
+    while True:
+        rows = store.export_page(table, list(spec["columns"]), last, since, until, spec["channel"], channel, page_size)
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        last = rows[-1]
+
+
+def iter_csv(pages, columns):
+    """
+    Render pages of rows as CSV, yielding one text chunk per page.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(columns), extrasaction="ignore")
+    writer.writeheader()
+
+    for rows in pages:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _ByteSink:
+    """
+    A write-only file that hands back what was written since the last drain, while
+    reporting the full stream position to the Parquet writer.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_value(kind, value):
+    if value is None:
+        return None
+    if kind == "timestamp":
+        return datetime.fromisoformat(value)
+    if kind == "string":
+        return str(value)
+    return value
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+    return pa, pq
+
+
+def iter_parquet(pages, columns):
+    """
+    Render pages of rows as a Parquet file, one row group per page, yielding the
+    bytes written so far after each page. Needs the optional pyarrow package.
+    """
+    pa, pq = _pyarrow()
+    types = {"string": pa.string(), "int": pa.int64(), "bool": pa.bool_(), "timestamp": pa.timestamp("us")}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns.items()])
+    sink = _ByteSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    try:
+        for rows in pages:
+            data = {name: [_parquet_value(kind, row.get(name)) for row in rows] for name, kind in columns.items()}
+            writer.write_table(pa.Table.from_pydict(data, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def export_table(table, fmt="csv", since=None, until=None, channel=None, page_size=EXPORT_PAGE_SIZE):
+    """
+    Stream a table as CSV (text chunks) or Parquet (byte chunks). Arguments are
+    validated before the first chunk, so errors surface before any output is sent.
+    """
+    spec = export_spec(table, channel)
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}. Options are: {', '.join(EXPORT_FORMATS)}")
+    for bound in (since, until):
+        parse_bound(bound)
+
+    pages = iter_pages(table, since, until, channel, page_size)
+    if fmt == "parquet":
+        _pyarrow()
+        return iter_parquet(pages, spec["columns"])
+    return iter_csv(pages, spec["columns"])
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(prog="python -m app.export", description="Export an activity log table.")
+    parser.add_argument("table", choices=list(EXPORT_TABLES))
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--since", help="first day to include, YYYY-MM-DD")
+    parser.add_argument("--until", help="day to stop before, YYYY-MM-DD")
+    parser.add_argument("--channel", help="only rows from this channel id")
+    parser.add_argument("--page-size", type=int, default=EXPORT_PAGE_SIZE)
+    parser.add_argument("-o", "--output", help="file to write (default: stdout)")
+    args = parser.parse_args()
+
+    try:
+        chunks = export_table(args.table, args.format, args.since, args.until, args.channel, args.page_size)
+    except (ValueError, RuntimeError) as e:
+        sys.exit(str(e))
+
+    binary = args.format == "parquet"
+    if args.output:
+        out = open(args.output, "wb" if binary else "w", newline=None if binary else "")
+    elif binary:
+        out = sys.stdout.buffer
+    else:
+        out = sys.stdout
+
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
@@ -0,0 +1,116 @@
+import threading
+
+from flask import g, request, jsonify
+from app.cache import TTLCache
+
+# Placeholder for a key whose first delivery is still being handled
+IN_FLIGHT = object()
+
+
+def request_key(form, payload=None):
+    """
+    The idempotency key for a Slack request: the slash command's trigger_id or the
+    Events API event_id. Returns None for requests that carry neither.
+    """
+    if form and form.get("trigger_id"):
+        return f"trigger:{form['trigger_id']}"
+    if payload and payload.get("event_id"):
+        return f"event:{payload['event_id']}"
+    return None
+
+
+def retried_by_slack(key):
+    """
+    Whether Slack redelivers the request behind `key` when it is answered slowly.
+    Slack retries Events API deliveries but never resends a slash command.
+    """
+    return key.startswith("event:")
+
+
+class IdempotencyStore:
+    """
+    Remembers the response sent for each Slack trigger so a retried request gets the
+    same response back without running its handler again. Keys live in an in-memory
+    LRU; `save(key, response)` persists the keys of deliveries Slack retries and
+    `load(key)` looks up a key another process answered. The database is only
+    consulted for requests Slack marks as retries, so slash commands never wait on it.
+    """
+
+    def __init__(self, load, save, ttl=3600, max_size=10000):
+        self.load = load
+        self.save = save
+        self._responses = TTLCache(max_size, ttl)
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def claim(self, key, is_retry=False):
+        """
+        Returns None if the caller should handle the request, otherwise the response
+        to repeat ({} while the first delivery is still in flight).
+        """
+        with self._lock:
+            cached = self._responses.get(key)
+            if cached is None:
+                self._responses.set(key, IN_FLIGHT)
+
+        if cached is None and is_retry:
+            try:
+                cached = self.load(key)
+            except Exception as e:
+                print(f"Failed to look up idempotency key {key}: {e}")
+            if cached is not None:
+                self._responses.set(key, cached)
+
+        if cached is None:
+            return None
+
+        self.duplicates += 1
+        return {} if cached is IN_FLIGHT else cached
+
+    def complete(self, key, response):
+        """
+        Record the response sent for a claimed key.
+        """
+        self._responses.set(key, response)
+        if not retried_by_slack(key):
+            return
+        try:
+            self.save(key, response)
+        except Exception as e:
+            print(f"Failed to persist idempotency key {key}: {e}")
+
+    def release(self, key):
+        """
+        Forget a claimed key whose handler failed, so a retry can run it again.
+        """
+        self._responses.invalidate(key)
+
+    def before_request(self):
+        """
+        before_request hook: answers duplicate deliveries from the store.
+        """
+        key = request_key(request.form, request.get_json(silent=True))
+        if key is None:
+            return None
+
+        cached = self.claim(key, is_retry="X-Slack-Retry-Num" in request.headers)
+        if cached is None:
+            g.idempotency_key = key
+            return None
+
+        print(f"Answered duplicate Slack request {key} from the idempotency store")
+        return jsonify(cached)
+
+    def after_request(self, response):
+        """
+        after_request hook: stores the response for the claimed key, or releases it on a server error.
+        """
+        key = g.pop("idempotency_key", None)
+        if key is None:
+            return response
+
+        if response.status_code >= 500 or not response.is_json:
+            self.release(key)
+        else:
+            self.complete(key, response.get_json())
+        return response
@@ -0,0 +1,242 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime
+
+LEADERBOARD_LIMIT = 3
+
+# Places kept in each closed month's snapshot
+SNAPSHOT_RANKS = 10
+
+# Leaderboard type -> (rollup counter board, period). Period "month" is the current UTC month.
+COUNTER_BOARDS = {
+    "brew_leaderboard": ("brew", "month"),
+    "brew_leaderboard_all_time": ("brew", "all"),
+    "restock_leaderboard": ("restock", "month"),
+    "restock_leaderboard_all_time": ("restock", "all"),
+    "last_cup_leaderboard": ("last_cup", "all"),
+    "accused_leaderboard": ("accused", "all"),
+    "accuser_leaderboard": ("accuser", "all"),
+}
+
+# Monthly winner leaderboard -> the counter board it ranks
+WINNER_BOARDS = {
+    "brewer_monthly_winners": "brew",
+    "restock_monthly_winners": "restock",
+}
+
+
+def current_month():
+    return datetime.utcnow().strftime("%Y-%m")
+
+
+def month_of(timestamp):
+    """
+    Rollup period for a timestamp given as a datetime or ISO string.
+    """
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return timestamp.strftime("%Y-%m")
+
+
+def next_month(month):
+    year, number = map(int, month.split("-"))
+    return f"{year + number // 12}-{number % 12 + 1:02d}"
+
+
+def month_name(month):
+    return datetime.strptime(month, "%Y-%m").strftime("%B %Y")
+
+
+def winner_summary(month, names, count):
+    return f"{month_name(month)} - {', '.join(names)} with {count} point{'' if count == 1 else 's'}"
+
+
+def snapshot_rows(board, ranked):
+    """
+    monthly_winner_snapshots rows built from (month, user_name, count, rank) rows
+    ordered by month and then rank.
+    """
+    months = {}
+    for row in ranked:
+        months.setdefault(row["month"], []).append(
+            {"user_name": row["user_name"], "count": row["count"], "rank": row["rank"]}
+        )
+
+    closed_at = datetime.utcnow().isoformat()
+    return [{
+        "board": board,
+        "month": month,
+        "month_name": month_name(month),
+        "summary": winner_summary(month, [row["user_name"] for row in rankings if row["rank"] == 1], rankings[0]["count"]),
+        "rankings": rankings[:SNAPSHOT_RANKS],
+        "closed_at": closed_at,
+    } for month, rankings in months.items()]
+
+
+class MonthlyArchive:
+    """
+    Winners of closed months, which never change once a month is over. Each board's
+    snapshots are read once per process and month, so serving winner history does
+    not depend on how much log history there is.
+    """
+
+    def __init__(self):
+        self._month = None
+        self._boards = {}
+        self._lock = threading.Lock()
+
+    def get(self, board, load):
+        """
+        The closed months' snapshot rows for a board, oldest first. `load(board)` runs
+        when the board has not been read yet this month.
+        """
+        month = current_month()
+        with self._lock:
+            if self._month != month:
+                self._month, self._boards = month, {}
+            if board not in self._boards:
+                self._boards[board] = load(board)
+            return self._boards[board]
+
+
+class CounterBoard:
+    """
+    Per-user counters for one board and period, kept in rank order so the top k
+    can be read without looking at the rest.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.names = {}
+        self._ranking = []  # sorted (-count, user_id)
+
+    def add(self, user_id, user_name, amount):
+        old = self.counts.get(user_id, 0)
+        if user_id in self.counts:
+            del self._ranking[bisect_left(self._ranking, (-old, user_id))]
+
+        self.counts[user_id] = old + amount
+        self.names[user_id] = user_name
+        insort(self._ranking, (-(old + amount), user_id))
+
+    def top(self, k):
+        rows = []
+        for negative_count, user_id in self._ranking[:k]:
+            if negative_count >= 0:
+                break
+            rows.append({"user_name": self.names[user_id], "count": -negative_count})
+        return rows
+
+    def leaders(self):
+        """
+        The names of everyone tied for first place, and their count.
+        """
+        if not self._ranking or self._ranking[0][0] >= 0:
+            return [], 0
+
+        first = self._ranking[0][0]
+        names = []
+        for negative_count, user_id in self._ranking:
+            if negative_count != first:
+                break
+            names.append(self.names[user_id])
+        return sorted(names), -first
+
+
+class CounterStore:
+    """
+    In-process mirror of the leaderboard_counters rollup table. It is loaded from the
+    table, kept current by the log_* functions, and reloaded after `ttl` seconds to
+    pick up writes made by other processes. Worker threads record events concurrently,
+    so every read and write of the boards holds one lock.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.loaded_at = None
+        self._boards = {}
+        self._lock = threading.Lock()
+
+    def is_stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl
+
+    def load(self, rows):
+        """
+        Replace the counters with rows of (board, period, user_id, user_name, count).
+        """
+        boards = {}
+        for row in rows:
+            key = (row["board"], row["period"])
+            boards.setdefault(key, CounterBoard()).add(row["user_id"], row["user_name"], row["count"])
+
+        with self._lock:
+            self._boards = boards
+            self.loaded_at = time.monotonic()
+
+    def record(self, board, timestamp, user_id, user_name, amount=1):
+        """
+        Count one event in both its month and the all-time period.
+        """
+        periods = (month_of(timestamp), "all")
+        with self._lock:
+            for period in periods:
+                self._boards.setdefault((board, period), CounterBoard()).add(user_id, user_name, amount)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._boards)
+
+    def top(self, board, period, k=LEADERBOARD_LIMIT):
+        if period == "month":
+            period = current_month()
+        with self._lock:
+            counter_board = self._boards.get((board, period))
+            return counter_board.top(k) if counter_board else []
+
+    def current_winners(self, board):
+        """
+        This month's winner row for a board, in the shape of a monthly snapshot, or None.
+        """
+        month = current_month()
+        with self._lock:
+            counter_board = self._boards.get((board, month))
+            names, count = counter_board.leaders() if counter_board else ([], 0)
+        if not names:
+            return None
+        return {"month": month, "month_name": month_name(month), "summary": winner_summary(month, names, count)}
+
+
+monthly_archive = MonthlyArchive()
+counter_store = CounterStore()
+
+
+def backfill():
+    """
+    Rebuild the leaderboard_counters rollup table from the raw log tables.
+    """
+    from app.utils import store, load_counter_store
+
+    store.rebuild_leaderboard_counters()
+    load_counter_store()
+    print(f"Rebuilt leaderboard counters for {len(counter_store)} board periods.")
+
+
+def close_months():
+    """
+    Snapshot the winners of every finished month that has not been closed yet.
+    """
+    from app.utils import load_winner_snapshots
+
+    for view, board in WINNER_BOARDS.items():
+        snapshots = load_winner_snapshots(board)
+        print(f"{view}: {len(snapshots)} closed months, latest {snapshots[-1]['month'] if snapshots else 'none'}.")
+
+
+if __name__ == "__main__":
+    import sys
+
+    commands = {"backfill": backfill, "close-months": close_months}
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        sys.exit("Usage: python -m app.leaderboard backfill|close-months")
+    commands[sys.argv[1]]()
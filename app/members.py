@@ -0,0 +1,336 @@
+import bisect
+import difflib
+import threading
+import time
+
+from app.cache import TTLCache
+from app.slack_client import slack
+
+# Below this many unknown members a roster is filled with users.info calls,
+# above it a single paginated users.list sweep is cheaper.
+USERS_INFO_FALLBACK_LIMIT = 5
+
+# /metrics names for MemberDirectory.stats()
+METRIC_SAMPLES = (
+    ("member_user_cache_size", "gauge", "user_cache_size"),
+    ("member_user_cache_hits_total", "counter", "user_cache_hits"),
+    ("member_user_cache_misses_total", "counter", "user_cache_misses"),
+    ("member_roster_cache_size", "gauge", "roster_cache_size"),
+    ("member_roster_cache_hits_total", "counter", "roster_cache_hits"),
+    ("member_roster_cache_misses_total", "counter", "roster_cache_misses"),
+    ("member_name_index_size", "gauge", "name_index_size"),
+    ("member_refreshes_total", "counter", "refresh_count"),
+    ("member_refresh_seconds_total", "counter", "refresh_seconds_total"),
+    ("member_last_refresh_seconds", "gauge", "last_refresh_seconds"),
+)
+
+
+def _user_record(user):
+    """
+    Reduce a Slack user object to the fields the bot cares about.
+    """
+    profile = user.get("profile") or {}
+    return {
+        "id": user["id"],
+        "name": user["name"],  # Slack username
+        "real_name": user.get("real_name") or profile.get("real_name"),  # Display name
+        "display_name": profile.get("display_name"),
+        "is_bot": user.get("is_bot", False),
+        "deleted": user.get("deleted", False),
+    }
+
+
+def _normalize(name):
+    return name.lstrip("@").strip().casefold()
+
+
+class NameIndex:
+    """
+    Case-insensitive index from usernames, real names and display names to users,
+    so a name typed into a command resolves without crawling the channel. Built
+    once from users.list and kept current with user_change / team_join events;
+    unlike the user cache, entries do not expire.
+    """
+
+    def __init__(self, fuzzy_cutoff=0.8):
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.built = False
+        self._records = {}
+        self._usernames = {}  # username -> user id; usernames are unique
+        self._names = {}  # any indexed name -> user ids
+        self._keys = []  # sorted names, for prefix search
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    @staticmethod
+    def _names_of(record):
+        names = {record["name"], record.get("real_name"), record.get("display_name")}
+        return {_normalize(name) for name in names if name}
+
+    def _remove(self, user_id):
+        record = self._records.pop(user_id, None)
+        if record is None:
+            return
+        self._usernames.pop(_normalize(record["name"]), None)
+        for name in self._names_of(record):
+            ids = self._names[name]
+            ids.discard(user_id)
+            if not ids:
+                del self._names[name]
+                del self._keys[bisect.bisect_left(self._keys, name)]
+
+    def _add(self, record):
+        self._records[record["id"]] = record
+        self._usernames[_normalize(record["name"])] = record["id"]
+        for name in self._names_of(record):
+            if name not in self._names:
+                self._names[name] = set()
+                bisect.insort(self._keys, name)
+            self._names[name].add(record["id"])
+
+    def update(self, record):
+        """
+        Add or replace one user. Bots and deactivated users are dropped from the index.
+        """
+        with self._lock:
+            self._remove(record["id"])
+            if not record["is_bot"] and not record["deleted"]:
+                self._add(record)
+
+    def build(self, records):
+        """
+        Replace the index with a full set of user records.
+        """
+        records = [record for record in records if not record["is_bot"] and not record["deleted"]]
+        with self._lock:
+            self._records, self._usernames, self._names = {}, {}, {}
+            for record in records:
+                self._records[record["id"]] = record
+                self._usernames[_normalize(record["name"])] = record["id"]
+                for name in self._names_of(record):
+                    self._names.setdefault(name, set()).add(record["id"])
+            self._keys = sorted(self._names)
+            self.built = True
+
+    def find(self, query, limit=5):
+        """
+        Return up to `limit` users matching a typed name: an exact username, then an
+        exact real or display name, then names starting with it, then close spellings.
+        More than one record means the name is ambiguous.
+        """
+        name = _normalize(query)
+        if not name:
+            return []
+
+        with self._lock:
+            if name in self._usernames:
+                return [self._records[self._usernames[name]]]
+
+            if name in self._names:
+                return self._records_for(self._names[name], limit)
+
+            ids = set()
+            index = bisect.bisect_left(self._keys, name)
+            while len(ids) < limit and index < len(self._keys) and self._keys[index].startswith(name):
+                ids.update(self._names[self._keys[index]])
+                index += 1
+
+            if ids:
+                return self._records_for(ids, limit)
+
+            # Only spellings with the same first letter and a similar length are compared
+            start = bisect.bisect_left(self._keys, name[0])
+            end = bisect.bisect_left(self._keys, chr(ord(name[0]) + 1))
+            length_slack = max(2, len(name) // 4)
+            candidates = [key for key in self._keys[start:end] if abs(len(key) - len(name)) <= length_slack]
+
+        # Fuzzy matching is the slow path (milliseconds), so it runs outside the lock
+        matches = difflib.get_close_matches(name, candidates, n=limit, cutoff=self.fuzzy_cutoff)
+        with self._lock:
+            ids = {user_id for key in matches for user_id in self._names.get(key, ())}
+            return self._records_for(ids, limit)
+
+    def _records_for(self, ids, limit):
+        return sorted((self._records[user_id] for user_id in ids), key=lambda record: record["name"])[:limit]
+
+
+class MemberDirectory:
+    """
+    Caches Slack user records and channel rosters so that resolving the members of a
+    channel does not cost one users.info round trip per member.
+    """
+
+    def __init__(self, client, user_ttl=3600, roster_ttl=300, max_users=10000, max_channels=64):
+        self.client = client
+        self.users = TTLCache(max_users, user_ttl)
+        self.rosters = TTLCache(max_channels, roster_ttl)
+        self.names = NameIndex()
+        # Bumped whenever a roster or user record changes, so callers can tell when a
+        # channel's user list is the one they already have
+        self.version = 0
+        self._channel_users = {}  # channel -> (version, users)
+        self._refresh_lock = threading.Lock()
+        self.refresh_count = 0
+        self.refresh_seconds_total = 0.0
+        self.last_refresh_seconds = 0.0
+
+    def _timed_refresh(self, refresh):
+        started = time.perf_counter()
+        try:
+            return refresh()
+        finally:
+            elapsed = time.perf_counter() - started
+            self.refresh_count += 1
+            self.refresh_seconds_total += elapsed
+            self.last_refresh_seconds = elapsed
+
+    def refresh_users(self):
+        """
+        Reload every user in the workspace with a paginated users.list sweep.
+        """
+        with self._refresh_lock:
+            self._timed_refresh(self._sweep_users)
+
+    def _sweep_users(self):
+        records = []
+        for user in self.client.paginate("users.list", {}, "members"):
+            record = _user_record(user)
+            self.users.set(user["id"], record)
+            records.append(record)
+        self.names.build(records)
+        self.version += 1
+
+    def get_user(self, user_id):
+        """
+        Return the cached record for a user, falling back to a single users.info call.
+        """
+        record = self.users.get(user_id)
+        if record is not None:
+            return record
+        return self._fetch_user(user_id)
+
+    def _fetch_user(self, user_id):
+        response = self.client.users_info(user_id)
+        if not response.get("ok"):
+            print(f"Error fetching user {user_id}: {response}")
+            return None
+
+        record = _user_record(response["user"])
+        self.users.set(user_id, record)
+        self.names.update(record)
+        self.version += 1
+        return record
+
+    def find_users(self, name):
+        """
+        Resolve a typed name to user records through the name index, building the
+        index with one users.list sweep the first time it is needed.
+        """
+        if not self.names.built:
+            with self._refresh_lock:
+                if not self.names.built:
+                    self._timed_refresh(self._sweep_users)
+        return self.names.find(name)
+
+    def get_channel_member_ids(self, channel_id):
+        """
+        Return the IDs of every member of a channel, following pagination.
+        """
+        member_ids = self.rosters.get(channel_id)
+        if member_ids is not None:
+            return member_ids
+
+        member_ids = self._timed_refresh(
+            lambda: list(self.client.paginate("conversations.members", {"channel": channel_id}, "members"))
+        )
+        self.rosters.set(channel_id, member_ids)
+        self.version += 1
+        return member_ids
+
+    def get_channel_users(self, channel_id):
+        """
+        Return the records of every non-bot user in a channel. The list is rebuilt
+        only after the roster or a user record has changed.
+        """
+        member_ids = self.get_channel_member_ids(channel_id)
+        cached = self._channel_users.get(channel_id)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+
+        records = {user_id: self.users.get(user_id) for user_id in member_ids}
+        missing = [user_id for user_id, record in records.items() if record is None]
+
+        if len(missing) > USERS_INFO_FALLBACK_LIMIT:
+            self.refresh_users()
+            records.update({user_id: self.users.get(user_id) for user_id in missing})
+            missing = [user_id for user_id in missing if records[user_id] is None]
+
+        for user_id, response in self.client.users_info_many(missing).items():
+            if response.get("ok"):
+                records[user_id] = _user_record(response["user"])
+                self.users.set(user_id, records[user_id])
+                self.names.update(records[user_id])
+                self.version += 1
+
+        users = [
+            record for record in (records[user_id] for user_id in member_ids)
+            if record is not None and not record["is_bot"]
+        ]
+        self._channel_users[channel_id] = (self.version, users)
+        return users
+
+    def roster_version(self, channel_id):
+        """
+        The version of the list get_channel_users last returned for a channel.
+        It changes whenever that list is rebuilt.
+        """
+        cached = self._channel_users.get(channel_id)
+        return cached[0] if cached is not None else None
+
+    def handle_event(self, event):
+        """
+        Keep the caches current from Slack Events API payloads.
+        """
+        event_type = event.get("type")
+
+        if event_type in ("member_joined_channel", "member_left_channel"):
+            self.rosters.invalidate(event.get("channel"))
+            self.version += 1
+
+        elif event_type in ("user_change", "team_join"):
+            user = event.get("user") or {}
+            if "id" in user:
+                record = _user_record(user)
+                self.users.set(user["id"], record)
+                self.names.update(record)
+                self.version += 1
+
+    def stats(self):
+        """
+        Cache hit/miss and refresh latency counters.
+        """
+        return {
+            "user_cache_size": len(self.users),
+            "user_cache_hits": self.users.hits,
+            "user_cache_misses": self.users.misses,
+            "roster_cache_size": len(self.rosters),
+            "roster_cache_hits": self.rosters.hits,
+            "roster_cache_misses": self.rosters.misses,
+            "name_index_size": len(self.names),
+            "refresh_count": self.refresh_count,
+            "refresh_seconds_total": round(self.refresh_seconds_total, 6),
+            "last_refresh_seconds": round(self.last_refresh_seconds, 6),
+        }
+
+    def metric_samples(self, **labels):
+        """
+        stats() as (name, kind, value, labels) samples for the /metrics collector.
+        """
+        stats = self.stats()
+        for name, kind, key in METRIC_SAMPLES:
+            yield name, kind, stats[key], labels
+
+
+member_directory = MemberDirectory(slack)
@@ -0,0 +1,213 @@
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+# Upper bounds in seconds, sized around Slack's 3-second acknowledgement budget
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 3.0, 5.0, 10.0)
+
+# Spans recorded while handling the current request or deferred command
+_spans = contextvars.ContextVar("spans", default=None)
+
+
+class Histogram:
+    """
+    Cumulative-bucket duration histogram in the Prometheus style.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics:
+    """
+    Process-wide request and dependency metrics, rendered in the Prometheus text format.
+    """
+
+    def __init__(self, prefix="coffee_bot"):
+        self.prefix = prefix
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def collector(self, collect):
+        """
+        Register `collect()`, called on every render. It yields (name, kind, value, labels)
+        samples for numbers other components keep themselves, e.g. cache sizes and hits.
+        """
+        self._collectors.append(collect)
+        return collect
+
+    @contextmanager
+    def span(self, dependency, operation):
+        """
+        Time a call to an external dependency. Exceptions count as errors; callers can
+        also flag a failed response by setting span["error"] = True.
+        """
+        span = {"dependency": dependency, "operation": operation, "error": False}
+        started = time.perf_counter()
+        try:
+            yield span
+        except Exception:
+            span["error"] = True
+            raise
+        finally:
+            self.record_span(span, time.perf_counter() - started)
+
+    def record_span(self, span, seconds):
+        labels = {"dependency": span["dependency"], "operation": span["operation"]}
+        self.observe("dependency_duration_seconds", seconds, **labels)
+        if span["error"]:
+            self.inc("dependency_errors_total", **labels)
+
+        spans = _spans.get()
+        if spans is not None:
+            spans.append(dict(span, duration_ms=round(seconds * 1000, 2)))
+
+    @contextmanager
+    def collect(self):
+        """
+        Gather the spans recorded inside this block, for the structured log line.
+        """
+        spans = []
+        token = _spans.set(spans)
+        try:
+            yield spans
+        finally:
+            _spans.reset(token)
+
+    def render(self):
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {self.prefix}_{name} {self._help[name]}")
+                lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+
+        for (name, labels), histogram in histograms:
+            header(name, "histogram")
+            for bound, count in histogram.cumulative():
+                lines.append(f"{self.prefix}_{name}_bucket{_labels(labels, le=bound)} {count}")
+            lines.append(f"{self.prefix}_{name}_bucket{_labels(labels, le='+Inf')} {histogram.count}")
+            lines.append(f"{self.prefix}_{name}_sum{_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{self.prefix}_{name}_count{_labels(labels)} {histogram.count}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{self.prefix}_{name}{_labels(labels)} {value}")
+
+        for collect in self._collectors:
+            try:
+                samples = sorted(collect(), key=lambda sample: sample[0])
+            except Exception as e:
+                print(f"Metrics collector {collect.__name__} failed: {e}")
+                continue
+            for name, kind, value, labels in samples:
+                header(name, kind)
+                lines.append(f"{self.prefix}_{name}{_labels(sorted(labels.items()))} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def log_json(event, **fields):
+    """
+    Write one structured log line.
+    """
+    print(json.dumps({"event": event, "time": round(time.time(), 3), **fields}, default=str), flush=True)
+
+
+def record_request(route, status, seconds, spans, **fields):
+    """
+    Record a finished request or deferred command: metrics plus one JSON log line.
+    """
+    metrics.observe("request_duration_seconds", seconds, route=route)
+    metrics.inc("requests_total", route=route, status=status)
+    if status >= 500:
+        metrics.inc("request_errors_total", route=route)
+    log_json("request", route=route, status=status, duration_ms=round(seconds * 1000, 2), spans=spans, **fields)
+
+
+def init_app(app):
+    """
+    Time every request served by a Flask app.
+    """
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_spans = []
+        g.metrics_token = _spans.set(g.metrics_spans)
+
+    @app.after_request
+    def stop_timer(response):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return response
+
+        _spans.reset(g.pop("metrics_token"))
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        record_request(route, response.status_code, time.perf_counter() - started, g.pop("metrics_spans"))
+        return response
+
+
+metrics = Metrics()
+metrics.describe("request_duration_seconds", "Time to answer a request, by route.")
+metrics.describe("requests_total", "Requests answered, by route and status.")
+metrics.describe("request_errors_total", "Requests that failed with a server error, by route.")
+metrics.describe("dependency_duration_seconds", "Time spent in Supabase and Slack calls, by operation.")
+metrics.describe("dependency_errors_total", "Failed Supabase and Slack calls, by operation.")
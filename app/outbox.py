@@ -0,0 +1,228 @@
+import atexit
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from app.config import BREAKER_RESET_SECONDS
+from app.resilience import CircuitOpenError
+
+# Slack truncates very long messages, so merged batches are split below this
+MAX_MESSAGE_LENGTH = 3500
+
+# Attempts at sending a batch that keeps failing before it is dropped
+MAX_SEND_ATTEMPTS = 3
+
+
+class _Channel:
+    def __init__(self, channel, client):
+        self.channel = channel
+        self.client = client
+        self.messages = []
+        self.updates = []
+        self.due = None
+        # True while a sender is working on this channel, so its batches go out in order
+        self.sending = False
+        self.attempts = 0
+        # The live status message: its ts, the UTC day it belongs to and its activity lines
+        self.status_ts = None
+        self.status_day = None
+        self.status_lines = []
+
+
+def _batches(messages):
+    """
+    Join messages with newlines into as few posts as fit within MAX_MESSAGE_LENGTH.
+    """
+    batch = ""
+    for message in messages:
+        if batch and len(batch) + 1 + len(message) > MAX_MESSAGE_LENGTH:
+            yield batch
+            batch = ""
+        batch = f"{batch}\n{message}" if batch else message
+    if batch:
+        yield batch
+
+
+class Outbox:
+    """
+    Coalesces outbound messages per channel. Messages queued for a channel within
+    `window` seconds of the first one go out as a single chat.postMessage, and status
+    updates edit one live "coffee status" message per channel per UTC day with
+    chat.update instead of posting.
+
+    Batches are sent by a pool of `senders` threads. A channel is only handed to one
+    sender at a time, so its messages arrive in the order they were queued, while a
+    slow or rate-limited channel doesn't hold up the others. A batch that fails is
+    retried with backoff up to MAX_SEND_ATTEMPTS times; while Slack's circuit is
+    open, unsent messages are held and retried after `retry_delay` seconds.
+
+    With `background=False` nothing is coalesced: each message is sent before `post`
+    or `status` returns, along with anything held back from an earlier failure.
+    """
+
+    def __init__(self, window=1.0, history=8, retry_delay=BREAKER_RESET_SECONDS, senders=4, background=True):
+        self.window = window
+        self.history = history
+        self.retry_delay = retry_delay
+        self.senders = senders
+        self.background = background
+        self._channels = {}
+        self._condition = threading.Condition()
+        self._pool = None
+        self._thread = None
+
+    def _start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._pool = ThreadPoolExecutor(self.senders, thread_name_prefix="outbox-sender")
+            self._thread = threading.Thread(target=self._run, daemon=True, name="outbox")
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def post(self, client, channel, text):
+        """
+        Queue a message for the channel.
+        """
+        self._enqueue(client, channel, "messages", text)
+
+    def status(self, client, channel, text):
+        """
+        Record an update in the channel's live status message.
+        """
+        self._enqueue(client, channel, "updates", (datetime.utcnow(), text))
+
+    def _enqueue(self, client, channel, kind, item):
+        if self.background and self._thread is None:
+            self._start()
+
+        with self._condition:
+            state = self._channels.get(channel)
+            if state is None:
+                state = self._channels[channel] = _Channel(channel, client)
+            state.client = client
+            getattr(state, kind).append(item)
+            if state.due is None:
+                state.due = time.monotonic() + self.window
+                self._condition.notify_all()
+
+        if not self.background:
+            self.flush()
+
+    def _take(self, everything=False):
+        """
+        Remove and return the batches that are due, oldest first, marking their
+        channels as sending. Channels a sender is still working on are skipped.
+        """
+        now = time.monotonic()
+        ready = [
+            state for state in self._channels.values()
+            if state.due is not None and not state.sending and (everything or state.due <= now)
+        ]
+        ready.sort(key=lambda state: state.due)
+
+        batches = []
+        for state in ready:
+            batches.append((state, state.messages, state.updates))
+            state.messages, state.updates, state.due = [], [], None
+            state.sending = True
+        return batches
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    dues = [state.due for state in self._channels.values() if state.due is not None and not state.sending]
+                    wait = min(dues) - time.monotonic() if dues else None
+                    if wait is not None and wait <= 0:
+                        break
+                    self._condition.wait(wait)
+                batches = self._take()
+
+            for batch in batches:
+                self._pool.submit(self._send, *batch)
+
+    def _send(self, state, messages, updates):
+        texts = list(_batches(messages))
+        try:
+            if updates:
+                self._update_status(state, updates)
+                updates = []
+            while texts:
+                response = state.client.post_message(state.channel, texts[0])
+                texts.pop(0)
+                if not response.get("ok"):
+                    print(f"Failed to send message: {response}")
+            state.attempts = 0
+        except CircuitOpenError as e:
+            # Slack is down: hold what is left and try again once the circuit may close
+            self._requeue(state, texts, updates, self.retry_delay)
+            print(f"Holding {len(texts) + len(updates)} messages for {state.channel}: {e}")
+        except Exception as e:
+            state.attempts += 1
+            if state.attempts < MAX_SEND_ATTEMPTS:
+                print(f"Failed to send to {state.channel}, retrying (attempt {state.attempts}): {e}")
+                self._requeue(state, texts, updates, self.window * 2 ** state.attempts)
+            else:
+                print(f"Failed to send to {state.channel}, dropping {len(texts) + len(updates)} messages: {e}")
+                state.attempts = 0
+        finally:
+            with self._condition:
+                state.sending = False
+                self._condition.notify_all()
+
+    def _requeue(self, state, messages, updates, delay):
+        with self._condition:
+            state.messages = messages + state.messages
+            state.updates = updates + state.updates
+            due = time.monotonic() + delay
+            state.due = max(state.due, due) if state.due is not None else due
+
+    def _update_status(self, state, updates):
+        today = datetime.utcnow().date()
+        if state.status_day != today:
+            state.status_ts, state.status_day, state.status_lines = None, today, []
+
+        # Only kept once Slack has the message, so a retried update isn't listed twice
+        lines = (state.status_lines + updates)[-self.history:]
+        text = self.render_status(lines)
+
+        if state.status_ts is not None:
+            response = state.client.update_message(state.channel, state.status_ts, text)
+            if response.get("ok"):
+                state.status_lines = lines
+                return
+            # The message was deleted or is too old to edit, so start a new one
+            print(f"Failed to update status message, posting a new one: {response}")
+
+        response = state.client.post_message(state.channel, text)
+        if response.get("ok"):
+            state.status_ts, state.status_lines = response.get("ts"), lines
+        else:
+            state.status_lines = lines
+            print(f"Failed to send message: {response}")
+
+    @staticmethod
+    def render_status(lines):
+        latest = lines[-1][1]
+        activity = "\n".join(f"• {at:%H:%M} {text}" for at, text in reversed(lines))
+        return f"☕ *Coffee status:* {latest}\n\n*Today (UTC)*\n{activity}"
+
+    def flush(self):
+        """
+        Send everything queued now, without waiting for the window. Waits for
+        channels that a sender is working on, so their order is kept.
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: not any(state.sending for state in self._channels.values()), timeout=30
+            )
+            batches = self._take(everything=True)
+
+        for batch in batches:
+            self._send(*batch)
+
+    def pending_count(self):
+        with self._condition:
+            return sum(len(state.messages) + len(state.updates) for state in self._channels.values())
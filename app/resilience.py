@@ -0,0 +1,132 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from app.config import BREAKER_FAILURES, BREAKER_RESET_SECONDS
+from app.metrics import metrics
+
+UNAVAILABLE_TEXT = "☕ The coffee bot can't reach {dependency} right now. Please try again in a minute."
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of calling a dependency whose circuit is open.
+    """
+
+    def __init__(self, dependency, retry_in):
+        super().__init__(f"{dependency} is unavailable, not retrying for {retry_in:.0f}s")
+        self.dependency = dependency
+
+
+class CircuitBreaker:
+    """
+    Fails fast while a dependency is unhealthy. After `failure_threshold` failures in a
+    row the circuit opens, and calls raise CircuitOpenError straight away for
+    `reset_timeout` seconds. Then a single trial call is let through: if it succeeds the
+    circuit closes, otherwise it opens again.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self.rejected = 0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def before(self):
+        """
+        Reserve a call, or raise CircuitOpenError if the circuit is open.
+        """
+        with self._lock:
+            if self.state == "closed":
+                return
+
+            waited = time.monotonic() - self.opened_at
+            if self.state == "open" and waited >= self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._trial:
+                self._trial = True
+                return
+
+            self.rejected += 1
+            retry_in = max(0.0, self.reset_timeout - waited)
+
+        metrics.inc("circuit_breaker_rejections_total", dependency=self.name)
+        raise CircuitOpenError(self.name, retry_in)
+
+    def success(self):
+        with self._lock:
+            self.state, self.failures, self._trial = "closed", 0, False
+
+    def failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            self._trial = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"Circuit for {self.name} opened after {self.failures} failures: {error}")
+                self.state, self.opened_at = "open", time.monotonic()
+
+    @contextmanager
+    def guard(self, caller_error=None):
+        """
+        Run one call through the breaker. Exceptions count as failures, except ValueError
+        and those `caller_error(e)` accepts, which mean the call itself was wrong. Callers
+        can also report a failed response by setting call["failed"] = True.
+        """
+        self.before()
+        call = {"failed": False}
+        try:
+            yield call
+        except Exception as e:
+            if isinstance(e, ValueError) or caller_error is not None and caller_error(e):
+                self.success()
+            else:
+                self.failure(e)
+            raise
+        if call["failed"]:
+            self.failure(call.get("error", "failed response"))
+        else:
+            self.success()
+
+    def status(self):
+        with self._lock:
+            status = {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "rejected_calls": self.rejected,
+                "last_error": self.last_error,
+            }
+            if self.state != "closed":
+                status["retry_in_seconds"] = round(max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at)), 1)
+            return status
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name):
+    """
+    The process-wide circuit breaker for a dependency, created on first use.
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def breaker_status():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {item.name: item.status() for item in breakers}
+
+
+def unavailable_payload(error):
+    return {"response_type": "ephemeral", "text": UNAVAILABLE_TEXT.format(dependency=error.dependency)}
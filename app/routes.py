@@ -1,171 +1,255 @@
+import re
 from flask import Blueprint, request, jsonify
-import requests
-from datetime import datetime, timedelta
-from app.utils import *
-from app.config import SLACK_BOT_TOKEN, COFFEE_CHANNEL_ID
-import threading
+from app.utils import (
+    announce_supply_alerts, close_accusation, get_leaderboard_data, idempotency_store, log_accusation,
+    log_brew, log_last_cup, log_restock, log_selected_brewer, log_vote, refute_latest_accusation,
+    pick_random_brewer, post_status, send_message, set_brewer_opt_out, tenants, LEADERBOARD_TYPES, MONTHLY_WINNER_VIEWS
+)
+from app.deferred import defer_command
+from app.security import verify_slack_request
 
 routes = Blueprint('routes', __name__)
 
+USER_ID_PATTERN = re.compile(r"^<?@?([UW][A-Z0-9]{6,})(?:\|[^>]*)?>?$")
+ACCUSATION_ID_PATTERN = re.compile(r"^[0-9a-fA-F]{8}-?(?:[0-9a-fA-F]{4}-?){3}[0-9a-fA-F]{12}$")
 
-def handle_dm(data, handler_function):
+# Every route in this blueprint is called by Slack. Signature checks run first, so
+# only authentic requests reach the idempotency store.
+routes.before_request(verify_slack_request)
+routes.before_request(idempotency_store.before_request)
+routes.after_request(idempotency_store.after_request)
+
+
+def resolve_tenant(data):
+    """
+    Finds the coffee channel (and its workspace) a slash command belongs to.
+    """
+    return tenants.resolve(data.get("team_id"), data.get("channel_id"))
+
+
+def command(path):
+    """
+    Registers a slash command handler on the blueprint. `handler(data, tenant)`
+    checks the request and returns either the reply or a function that does the work
+    after Slack has been acknowledged; the dict that function returns is posted to the
+    command's response_url.
+    """
+    def register(handler):
+        def view():
+            data = request.form.to_dict()
+            tenant = resolve_tenant(data)
+            reply = handler(data, tenant)
+            if callable(reply):
+                reply = defer_command(data, reply, tenant_key=tenant.key)
+            return jsonify(reply)
+
+        routes.add_url_rule(path, handler.__name__, view, methods=['POST'])
+        return handler
+    return register
+
+
+def handle_dm(data, tenant, handler_function):
     """
     Handles commands sent via direct message (DM) and routes them to the appropriate handler function.
-    Posts results to the channel.
+    Posts results to the tenant's coffee channel. Returns the work to run after Slack has been acknowledged.
     """
     user_id = data.get("user_id")
     user_name = data.get("user_name")
     text = data.get("text", "").strip()
 
     # Pass data to the handler function
-    return handler_function(user_id, user_name, text)
+    return lambda: handler_function(user_id, user_name, text, tenant)
 
 
-@routes.route('/brew', methods=['POST'])
-def brew():
-    def handler(user_id, user_name, _):
+def format_leaderboard(leaderboard_type, leaderboard_data):
+    """
+    Builds the channel message for a leaderboard.
+    """
+    # Format differently if it's a monthly winner summary
+    if "monthly_winners" in leaderboard_type:
+        title = "🏆 Top Brewers" if "brewer" in leaderboard_type else "🥫 Top Restockers"
+        leaderboard_message = f"{title}\n"
+        for row in leaderboard_data:
+            leaderboard_message += row["summary"] + "\n"
+    else:
+        title = leaderboard_type.replace('_', ' ').title()
+        leaderboard_message = f"📊 *{title} Top 3 Users:*\n"
+        for rank, row in enumerate(leaderboard_data, start=1):
+            leaderboard_message += f"{rank}. *{row['user_name']}* - {row['count']} points\n"
+
+    return leaderboard_message
+
+
+def vote_verdict(accusation_id, accept_votes, reject_votes):
+    """
+    Returns the announcement for a tallied accusation. A tie leaves it upheld.
+    """
+    if accept_votes > reject_votes:
+        return f"✅ Accusation #{accusation_id} has been upheld with {accept_votes} accept votes and {reject_votes} reject votes!"
+    if reject_votes > accept_votes:
+        return f"❌ Accusation #{accusation_id} has been dismissed with {reject_votes} reject votes and {accept_votes} accept votes!"
+    return f"🤔 Accusation #{accusation_id} resulted in a tie with {accept_votes} accept votes and {reject_votes} reject votes!"
+
+
+def vote_response(accusation_id, vote, status):
+    """
+    The reply to /judge for a cast_vote status.
+    """
+    if status == "unknown":
+        return {"response_type": "ephemeral", "text": f"Accusation #{accusation_id} not found."}
+    if status == "duplicate":
+        return {"response_type": "ephemeral", "text": f"You have already voted on accusation #{accusation_id}."}
+    return {"response_type": "ephemeral", "text": f"Your vote to {vote} accusation #{accusation_id} has been recorded."}
+
+
+@command('/brew')
+def brew(data, tenant):
+    def handler(user_id, user_name, _, tenant):
         # Log the brewing activity
-        log_brew(user_id, user_name, COFFEE_CHANNEL_ID)
+        log_brew(user_id, user_name, tenant.channel_id)
 
         # Notify the channel
         initial_message = f"*{user_name}* has started brewing!"
-        send_message(COFFEE_CHANNEL_ID, initial_message)
+        post_status(tenant.channel_id, initial_message, tenant)
+        announce_supply_alerts(tenant.channel_id, tenant)
 
         return {"text": "Brewing timer started! The coffee channel will be notified."}
 
-    return jsonify(handle_dm(request.form, handler))
+    return handle_dm(data, tenant, handler)
 
 
-@routes.route('/pick-brewer', methods=['POST'])
-def pick_brewer():
-    def handler(_, __, ___):
+@command('/pick-brewer')
+def pick_brewer(data, tenant):
+    def handler(_, __, ___, tenant):
         # Fetch a user who has not been picked today
-        selected_user = pick_random_brewer(COFFEE_CHANNEL_ID)
+        selected_user = pick_random_brewer(tenant.channel_id, tenant)
         if not selected_user:
             return {"text": "No eligible users found in the coffee channel!"}
 
         # Notify the channel
         user_name = selected_user["name"]
         message = f"@{user_name} you've been picked to brew!"
-        send_message(COFFEE_CHANNEL_ID, message)
+        send_message(tenant.channel_id, message, tenant)
 
         # Log the selected brewer
-        log_selected_brewer(selected_user["id"], user_name, COFFEE_CHANNEL_ID)
+        log_selected_brewer(selected_user["id"], user_name, tenant.channel_id)
         return {"text": message}
 
-    return jsonify(handle_dm(request.form, handler))
+    return handle_dm(data, tenant, handler)
+
 
+@command('/opt-out')
+def opt_out(data, tenant):
+    def handler(user_id, _, text, __):
+        # "/opt-out" leaves the brewer rotation, "/opt-out undo" rejoins it
+        opted_out = text.lower() != "undo"
+        set_brewer_opt_out(user_id, opted_out)
 
-@routes.route('/running-low', methods=['POST'])
-def running_low():
-    def handler(_, __, ___):
+        if opted_out:
+            return {"text": "You won't be picked by /pick-brewer. Use `/opt-out undo` to rejoin."}
+        return {"text": "You're back in the /pick-brewer rotation."}
+
+    return handle_dm(data, tenant, handler)
+
+
+@command('/running-low')
+def running_low(data, tenant):
+    def handler(_, __, ___, tenant):
         message = "☕ There's only one cup of coffee left! Get it while it's hot!"
-        send_message(COFFEE_CHANNEL_ID, message)
+        post_status(tenant.channel_id, message, tenant)
         return {"text": "The coffee channel has been notified."}
 
-    return jsonify(handle_dm(request.form, handler))
+    return handle_dm(data, tenant, handler)
 
 
-@routes.route('/last-cup', methods=['POST'])
-def last_cup():
-    def handler(user_id, user_name, _):
+@command('/last-cup')
+def last_cup(data, tenant):
+    def handler(user_id, user_name, _, tenant):
         # Log the user who took the last cup
-        log_last_cup(user_id, user_name, COFFEE_CHANNEL_ID)
+        log_last_cup(user_id, user_name, tenant.channel_id)
 
         # Notify the channel
         message = "☕ Coffee pot is empty!"
-        send_message(COFFEE_CHANNEL_ID, message)
+        post_status(tenant.channel_id, message, tenant)
 
         return {"text": "The coffee channel has been notified."}
 
-    return jsonify(handle_dm(request.form, handler))
+    return handle_dm(data, tenant, handler)
 
 
-@routes.route('/accuse', methods=['POST'])
-def accuse():
+@command('/accuse')
+def accuse(data, tenant):
     """
     Handles the /accuse command to log an accusation and notify the channel.
     """
-    data = request.form
-
     # Extract data from the command payload
     accuser_id = data.get("user_id")
     accuser_name = data.get("user_name")
     input_text = data.get("text").strip()  # Slack sends the text following the command
     channel_id = data.get("channel_id")
 
-    # Debugging: Log the raw input text
-    print(f"Received input text: {input_text}")
-
     # Check if input is empty
     if not input_text:
-        return jsonify({
+        return {
             "response_type": "ephemeral",
             "text": "Please specify a user to accuse. Example: `/accuse username`"
-        })
+        }
+
+    def handler():
+        # Slack user IDs (e.g. U12345678) or escaped mentions (<@U12345678|name>) resolve directly
+        mention = USER_ID_PATTERN.match(input_text)
+        if mention:
+            accused_id = mention.group(1)
+            accused_user = tenant.members.get_user(accused_id)
+
+            if not accused_user:
+                return {
+                    "response_type": "ephemeral",
+                    "text": f"Could not resolve user with ID {accused_id}."
+                }
+        else:
+            # Otherwise, resolve input as a username, real name or display name
+            accused_name = input_text.lstrip("@").strip()
+            matches = tenant.members.find_users(accused_name)
 
-    # Try resolving as user ID directly (e.g., U12345678)
-    if input_text.startswith("U") and len(input_text) > 5:
-        accused_id = input_text
-    else:
-        # Otherwise, resolve input as a username
-        accused_name = input_text.lstrip("@").strip()
+            if not matches:
+                return {
+                    "response_type": "ephemeral",
+                    "text": f"Could not find a user named {accused_name}."
+                }
 
-        # Fetch users in the channel to resolve the username to user ID
-        users = get_channel_users(channel_id)
-        accused_user = next((user for user in users if user["name"] == accused_name), None)
+            if len(matches) > 1:
+                candidates = ", ".join(f"@{user['name']}" for user in matches[:5])
+                return {
+                    "response_type": "ephemeral",
+                    "text": f"More than one user matches {accused_name}: {candidates}. Please be more specific."
+                }
 
-        if not accused_user:
-            return jsonify({
-                "response_type": "ephemeral",
-                "text": f"Could not find a user named {accused_name} in the channel."
-            })
+            accused_user = matches[0]
 
         accused_id = accused_user["id"]
+        accused_name = accused_user["name"]
 
-    # Fetch accused user's details from Slack API
-    user_info = requests.get(
-        "https://slack.com/api/users.info",
-        headers={"Authorization": f"Bearer {SLACK_BOT_TOKEN}"},
-        params={"user": accused_id}
-    ).json()
+        # Log the accusation and get the accusation ID
+        accusation_id = log_accusation(accuser_id, accuser_name, accused_id, accused_name, channel_id)
 
-    if not user_info.get("ok"):
-        return jsonify({
+        # Notify the channel with the accusation and ID
+        message = f"@{accused_name} has been accused of taking the last cup! (Accusation ID: {accusation_id})"
+        send_message(channel_id, message, tenant)
+
+        # Respond to the accuser with a private acknowledgment
+        return {
             "response_type": "ephemeral",
-            "text": f"Could not resolve user with ID {accused_id}."
-        })
-
-    accused_name = user_info["user"]["name"]
-
-    # Log the accusation and get the accusation ID
-    accusation_id = log_accusation(accuser_id, accuser_name, accused_id, accused_name, channel_id)
-
-    # Notify the channel with the accusation and ID
-    message = f"@{accused_name} has been accused of taking the last cup! (Accusation ID: {accusation_id})"
-    send_message(channel_id, message)
-
-    # Respond to the accuser with a private acknowledgment
-    return jsonify({
-        "response_type": "ephemeral",
-        "text": f"Your accusation has been sent to the channel. Accusation ID: {accusation_id}"
-    })
-
-
-@routes.route('/leaderboard', methods=['POST'])
-def leaderboard():
-    def handler(_, __, leaderboard_type):
-        valid_options = [
-            "accused_leaderboard",
-            "accuser_leaderboard",
-            "brew_leaderboard",
-            "brew_leaderboard_all_time",
-            "restock_leaderboard",
-            "restock_leaderboard_all_time",
-            "last_cup_leaderboard",
-            "brewer_monthly_winners",
-            "restock_monthly_winners"
-        ]
+            "text": f"Your accusation has been sent to the channel. Accusation ID: {accusation_id}"
+        }
+
+    return handler
+
+
+@command('/leaderboard')
+def leaderboard(data, tenant):
+    def handler(_, __, leaderboard_type, tenant):
+        valid_options = LEADERBOARD_TYPES + MONTHLY_WINNER_VIEWS
 
         if leaderboard_type not in valid_options:
             return {
@@ -175,80 +259,57 @@ def leaderboard():
 
         # Fetch the data
         leaderboard_data = get_leaderboard_data(leaderboard_type)
-        print(f"Leaderboard Data: {leaderboard_data}")
 
         if not leaderboard_data:
             return {"text": f"No data available for {leaderboard_type}."}
 
-        # Format differently if it's a monthly winner summary
-        if "monthly_winners" in leaderboard_type:
-            title = "🏆 Top Brewers" if "brewer" in leaderboard_type else "🥫 Top Restockers"
-            leaderboard_message = f"{title}\n"
-            for row in leaderboard_data:
-                leaderboard_message += row["summary"] + "\n"
-        else:
-            title = leaderboard_type.replace('_', ' ').title()
-            leaderboard_message = f"📊 *{title} Top 3 Users:*\n"
-            for rank, row in enumerate(leaderboard_data, start=1):
-                leaderboard_message += f"{rank}. *{row['user_name']}* - {row['count']} points\n"
-
         # Send to channel and return confirmation
-        send_message(COFFEE_CHANNEL_ID, leaderboard_message)
+        send_message(tenant.channel_id, format_leaderboard(leaderboard_type, leaderboard_data), tenant)
         return {"text": "Leaderboard has been posted in the coffee channel."}
 
-    return jsonify(handle_dm(request.form, handler))
+    return handle_dm(data, tenant, handler)
 
 
-@routes.route('/liar', methods=['POST'])
-def liar():
+@command('/liar')
+def liar(data, tenant):
     """
-    Handles the /liar command to refute the most recent accusation made in the past 24 hours.
+    Handles the /liar command to refute the channel's most recent open accusation made in the past 24 hours.
     """
 
-    data = request.form
-
     # Extract data from the command payload
     channel_id = data.get("channel_id")
 
-    # Calculate the 24-hour window
-    time_limit = datetime.utcnow() - timedelta(hours=24)
+    def handler():
+        # Find and refute the latest open accusation in one round trip
+        accusation = refute_latest_accusation(channel_id)
 
-    # Fetch the most recent accusation within the past 24 hours
-    recent_accusation = supabase.table("accusations").select("*").filter(
-        "timestamp", "gte", time_limit.isoformat()
-    ).order("timestamp", desc=True).limit(1).execute()
-
-    if not recent_accusation.data:
-        return jsonify({
-            "response_type": "ephemeral",
-            "text": "No accusations found in the past 24 hours! Nothing to refute."
-        })
+        if not accusation:
+            return {
+                "response_type": "ephemeral",
+                "text": "No open accusations found in the past 24 hours! Nothing to refute."
+            }
 
-    # Get the accusation details
-    accusation = recent_accusation.data[0]
-    accusation_id = accusation["id"]
-    accused_name = accusation["accused_name"]
+        # Get the accusation details
+        accusation_id = accusation["id"]
+        accused_name = accusation["accused_name"]
 
-    # Log the refutation
-    log_refutation(accusation_id, channel_id)
+        # Notify the channel
+        message = f"🔔 Accusation #{accusation_id} against @{accused_name} has been refuted! Let the debates begin!"
+        send_message(channel_id, message, tenant)
 
-    # Notify the channel
-    message = f"🔔 Accusation #{accusation_id} against @{accused_name} has been refuted! Let the debates begin!"
-    send_message(channel_id, message)
+        return {
+            "response_type": "ephemeral",
+            "text": f"Your refutation has been logged anonymously for accusation #{accusation_id} against @{accused_name}."
+        }
 
-    return jsonify({
-        "response_type": "ephemeral",
-        "text": f"Your refutation has been logged anonymously for accusation #{accusation_id} against @{accused_name}."
-    })
+    return handler
 
 
-@routes.route('/judge', methods=['POST'])
-def judge():
+@command('/judge')
+def judge(data, tenant):
     """
     Handles the /judge command to allow users to vote on an accusation.
     """
-    data = request.form
-
     # Extract command data
     user_id = data.get("user_id")
     user_name = data.get("user_name")
@@ -258,96 +319,81 @@ def judge():
     try:
         accusation_id, vote = input_text.split()  # No need to cast to int
     except ValueError:
-        return jsonify({
+        return {
             "response_type": "ephemeral",
             "text": "Invalid format. Use `/judge accusation_id accept|reject`."
-        })
+        }
+
+    if not ACCUSATION_ID_PATTERN.match(accusation_id):
+        return {
+            "response_type": "ephemeral",
+            "text": f"Accusation #{accusation_id} not found."
+        }
 
     # Validate the vote
     if vote not in ["accept", "reject"]:
-        return jsonify({
+        return {
             "response_type": "ephemeral",
             "text": "Invalid vote. Use `accept` or `reject`."
-        })
+        }
 
-    # Log the vote
-    supabase.table("votes").insert({
-        "accusation_id": accusation_id,  # Keep as UUID (string)
-        "voter_id": user_id,
-        "voter_name": user_name,
-        "vote": vote
-    }).execute()
+    def handler():
+        # Log the vote
+        return vote_response(accusation_id, vote, log_vote(accusation_id, user_id, user_name, vote))
 
-    return jsonify({
-        "response_type": "ephemeral",
-        "text": f"Your vote to {vote} accusation #{accusation_id} has been recorded."
-    })
+    return handler
 
 
-@routes.route('/call_vote', methods=['POST'])
-def call_vote():
+@command('/call_vote')
+def call_vote(data, tenant):
     """
     Tally votes for an accusation and announce the result.
     """
-    data = request.form
-
     # Extract data from the command payload
     channel_id = data.get("channel_id")
     input_text = data.get("text", "").strip()  # Ensure input_text is not None
 
     # Validate accusation_id
     if not input_text:
-        return jsonify({
+        return {
             "response_type": "ephemeral",
             "text": "Invalid format. Use `/call_vote accusation_id`."
-        })
+        }
 
     accusation_id = input_text  # Since it's a UUID, no casting needed
-
-    # Fetch votes for the accusation
-    votes = supabase.table("votes").select("*").filter(
-        "accusation_id", "eq", accusation_id
-    ).execute()
-
-    if not votes.data:
-        return jsonify({
+    if not ACCUSATION_ID_PATTERN.match(accusation_id):
+        return {
             "response_type": "ephemeral",
             "text": f"No votes found for accusation #{accusation_id}."
-        })
+        }
 
-    # Tally votes
-    accept_votes = sum(1 for vote in votes.data if vote["vote"] == "accept")
-    reject_votes = sum(1 for vote in votes.data if vote["vote"] == "reject")
+    def handler():
+        # Tally votes and record the verdict in one round trip
+        closed = close_accusation(accusation_id)
 
-    # Determine result
-    if accept_votes > reject_votes:
-        result = f"✅ Accusation #{accusation_id} has been upheld with {accept_votes} accept votes and {reject_votes} reject votes!"
-        refuted = False  # Accusation is not refuted
-    elif reject_votes > accept_votes:
-        result = f"❌ Accusation #{accusation_id} has been dismissed with {reject_votes} reject votes and {accept_votes} accept votes!"
-        refuted = True  # Accusation is refuted
-    else:
-        result = f"🤔 Accusation #{accusation_id} resulted in a tie with {accept_votes} accept votes and {reject_votes} reject votes!"
-        refuted = False  # Tie doesn't mark it as refuted
+        if not closed or not closed["accept"] and not closed["reject"]:
+            return {
+                "response_type": "ephemeral",
+                "text": f"No votes found for accusation #{accusation_id}."
+            }
 
-    # Update the accusation with judged and refuted status
-    supabase.table("accusations").update({
-        "judged": True,
-        "refuted": refuted
-    }).eq("id", accusation_id).execute()
+        # Determine result
+        result = vote_verdict(accusation_id, closed["accept"], closed["reject"])
 
-    # Post result in the channel
-    send_message(channel_id, result)
+        # Post result in the channel
+        send_message(channel_id, result, tenant)
 
-    return jsonify({
-        "response_type": "ephemeral",
-        "text": f"The votes for accusation #{accusation_id} have been tallied."
-    })
+        return {
+            "response_type": "ephemeral",
+            "text": f"The votes for accusation #{accusation_id} have been tallied."
+        }
 
+    return handler
 
-@routes.route('/restock', methods=['POST'])
-def restock():
-    def handler(user_id, user_name, text):
+
+@command('/restock')
+def restock(data, tenant):
+    def handler(user_id, user_name, text, tenant):
         try:
             item, quantity_str = text.strip().split()
             quantity = int(quantity_str)
@@ -358,7 +404,7 @@ def restock():
             point_word = "point" if points == 1 else "points"
 
             public_message = f"✅ *{user_name}* restocked {quantity} {item_display}. They earned {points} {point_word}!"
-            send_message(COFFEE_CHANNEL_ID, public_message)
+            post_status(tenant.channel_id, public_message, tenant)
 
             return {"text": "☑️ Restock recorded and announced!"}  # ephemeral by default
 
@@ -368,4 +414,21 @@ def restock():
                 "text": f"❌ Error: {str(e)}\nUsage: `/restock item quantity` (e.g. `/restock creamer 4`)"
             }
 
-    return jsonify(handle_dm(request.form, handler))
+    return handle_dm(data, tenant, handler)
+
+
+@routes.route('/events', methods=['POST'])
+def events():
+    """
+    Receives Slack Events API callbacks used to keep the member directory current.
+    """
+    payload = request.get_json(silent=True) or {}
+
+    # Slack verifies the endpoint once with a challenge when it is configured
+    if payload.get("type") == "url_verification":
+        return jsonify({"challenge": payload.get("challenge")})
+
+    if payload.get("type") == "event_callback":
+        tenants.resolve(payload.get("team_id")).members.handle_event(payload.get("event", {}))
+
+    return "", 200
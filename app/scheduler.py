@@ -0,0 +1,159 @@
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime
+
+# /metrics names for JobScheduler.stats()
+METRIC_SAMPLES = (
+    ("scheduler_jobs_pending", "gauge", "pending"),
+    ("scheduler_next_due_seconds", "gauge", "next_due_in_seconds"),
+    ("scheduler_jobs_fired_total", "counter", "fired"),
+    ("scheduler_jobs_failed_total", "counter", "failed"),
+    ("scheduler_jobs_skipped_total", "counter", "skipped"),
+    ("scheduler_last_lag_seconds", "gauge", "last_lag_seconds"),
+    ("scheduler_max_lag_seconds", "gauge", "max_lag_seconds"),
+    ("scheduler_avg_lag_seconds", "gauge", "avg_lag_seconds"),
+)
+
+
+def to_epoch(moment):
+    """
+    Seconds since the epoch for a naive UTC datetime or ISO timestamp.
+    """
+    if isinstance(moment, str):
+        moment = datetime.fromisoformat(moment.replace("Z", "+00:00")).replace(tzinfo=None)
+    return (moment - datetime(1970, 1, 1)).total_seconds()
+
+
+class JobScheduler:
+    """
+    Heap-based delayed-job scheduler running on one background thread.
+
+    `claim(job_id)` must atomically mark a job as taken and return False if another
+    process already took it, so a job never fires twice. `run(job)` does the work and
+    `complete(job_id, ok)` records the outcome. Pending jobs are reloaded from
+    `load_pending()` in the background when the scheduler starts.
+    """
+
+    def __init__(self, load_pending, claim, run, complete):
+        self.load_pending = load_pending
+        self.claim = claim
+        self.run = run
+        self.complete = complete
+        self._heap = []
+        self._ids = set()
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self.fired = 0
+        self.failed = 0
+        self.skipped = 0
+        self.last_lag_seconds = 0.0
+        self.max_lag_seconds = 0.0
+        self.total_lag_seconds = 0.0
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, daemon=True, name="job-scheduler")
+            self._thread.start()
+
+    def _load(self):
+        # Runs on the scheduler thread so start() never blocks start-up on the database
+        try:
+            jobs = self.load_pending()
+        except Exception as e:
+            print(f"Failed to load pending jobs: {e}")
+            return
+
+        for job in jobs:
+            self.schedule(job)
+        print(f"Scheduler started with {len(jobs)} pending jobs.")
+
+    def schedule(self, job):
+        """
+        Queue a job dict with at least "id" and "execute_at".
+        """
+        with self._condition:
+            if job["id"] in self._ids:
+                return
+            self._ids.add(job["id"])
+            heapq.heappush(self._heap, (to_epoch(job["execute_at"]), next(self._sequence), job))
+            self._condition.notify()
+
+    def _next_due(self):
+        """
+        Block until the earliest job is due and pop it.
+        """
+        with self._condition:
+            while True:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                due_at = self._heap[0][0]
+                delay = due_at - time.time()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+
+                _, _, job = heapq.heappop(self._heap)
+                self._ids.discard(job["id"])
+                return due_at, job
+
+    def _loop(self):
+        self._load()
+        while True:
+            due_at, job = self._next_due()
+            try:
+                self._fire(due_at, job)
+            except Exception as e:
+                print(f"Scheduled job {job['id']} failed: {e}")
+
+    def _fire(self, due_at, job):
+        if not self.claim(job["id"]):
+            self.skipped += 1
+            return
+
+        lag = max(0.0, time.time() - due_at)
+        self.last_lag_seconds = lag
+        self.max_lag_seconds = max(self.max_lag_seconds, lag)
+        self.total_lag_seconds += lag
+
+        try:
+            self.run(job)
+        except Exception as e:
+            self.failed += 1
+            self.complete(job["id"], False)
+            raise e
+
+        self.fired += 1
+        self.complete(job["id"], True)
+
+    def stats(self):
+        with self._condition:
+            pending = len(self._heap)
+            next_due_in = self._heap[0][0] - time.time() if self._heap else None
+
+        attempts = self.fired + self.failed
+        return {
+            "pending": pending,
+            "next_due_in_seconds": round(next_due_in, 3) if next_due_in is not None else None,
+            "fired": self.fired,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "last_lag_seconds": round(self.last_lag_seconds, 3),
+            "max_lag_seconds": round(self.max_lag_seconds, 3),
+            "avg_lag_seconds": round(self.total_lag_seconds / attempts, 3) if attempts else 0.0,
+        }
+
+    def metric_samples(self, **labels):
+        """
+        stats() as (name, kind, value, labels) samples for the /metrics collector.
+        """
+        stats = self.stats()
+        for name, kind, key in METRIC_SAMPLES:
+            if stats[key] is not None:
+                yield name, kind, stats[key], labels
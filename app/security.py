@@ -0,0 +1,126 @@
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request, jsonify
+from app.config import SIGNING_SECRET, SKIP_SLACK_VERIFICATION
+
+# Slack recommends rejecting requests more than five minutes old
+MAX_REQUEST_AGE = 60 * 5
+
+
+class ReplayCache:
+    """
+    Bounded record of recently accepted signatures. Slack signs each delivery of a
+    request identically, so a repeated signature inside the age window is a replay.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, signature, timestamp):
+        """
+        Record a signature; returns True if it was already recorded.
+        """
+        with self._lock:
+            if signature in self._seen:
+                return True
+
+            self._seen[signature] = timestamp
+            while len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+            return False
+
+
+class SignatureVerifier:
+    """
+    Verifies the X-Slack-Signature HMAC on incoming requests. Without a signing secret
+    every request is refused, unless `skip` explicitly allows unverified requests.
+    """
+
+    def __init__(self, signing_secret, max_age=MAX_REQUEST_AGE, replay_cache=None, skip=False):
+        self._key = signing_secret.encode() if signing_secret else None
+        self.max_age = max_age
+        self.replays = replay_cache or ReplayCache()
+        self.skip = skip
+
+    @property
+    def enabled(self):
+        return self._key is not None
+
+    def verify(self, timestamp, signature, body, now=None):
+        """
+        Returns None for a valid, first-seen request, otherwise the rejection reason.
+        """
+        if not timestamp or not signature:
+            return "missing signature"
+
+        try:
+            age = (now or time.time()) - int(timestamp)
+        except ValueError:
+            return "bad timestamp"
+        if abs(age) > self.max_age:
+            return "stale timestamp"
+
+        base = b"v0:" + timestamp.encode() + b":" + body
+        expected = "v0=" + hmac.new(self._key, base, hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(expected, signature):
+            return "bad signature"
+
+        if self.replays.seen(signature, timestamp):
+            return "replay"
+
+        return None
+
+    def check(self, timestamp, signature, body, path):
+        """
+        Returns None if the request should be handled, otherwise the (body, status, headers)
+        to answer with instead. Forged or stale requests get a 401; replays of a request
+        already handled are acknowledged with an empty 200 so Slack stops retrying.
+        """
+        if not self.enabled:
+            if self.skip:
+                return None
+            print(f"Rejected Slack request to {path}: SIGNING_SECRET is not set")
+            return {"error": "request verification is not configured"}, 401, {}
+
+        reason = self.verify(timestamp, signature, body)
+        if reason is None:
+            return None
+
+        if reason == "replay":
+            return "", 200, {"X-Slack-No-Retry": "1"}
+
+        print(f"Rejected Slack request to {path}: {reason}")
+        return {"error": "invalid request signature"}, 401, {}
+
+
+verifier = SignatureVerifier(SIGNING_SECRET, skip=SKIP_SLACK_VERIFICATION)
+
+if not verifier.enabled:
+    if verifier.skip:
+        print("WARNING: SKIP_SLACK_VERIFICATION=1, Slack requests are accepted without signature checks.")
+    else:
+        print("WARNING: SIGNING_SECRET is not set, so every Slack request will be rejected. "
+              "Set SKIP_SLACK_VERIFICATION=1 to accept unverified requests for local testing.")
+
+
+def verify_slack_request():
+    """
+    before_request hook for Slack-facing blueprints.
+    """
+    rejection = verifier.check(
+        request.headers.get("X-Slack-Request-Timestamp"),
+        request.headers.get("X-Slack-Signature"),
+        request.get_data(cache=True),
+        request.path
+    )
+    if rejection is None:
+        return None
+
+    body, status, headers = rejection
+    return (jsonify(body) if isinstance(body, dict) else body), status, headers
@@ -0,0 +1,374 @@
+import heapq
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app.config import BREWER_SELECTION_STRATEGY
+from app.scheduler import to_epoch
+
+
+def utc_day_bounds(day):
+    """
+    ISO timestamps for the start of `day` and of the following day, in UTC.
+    """
+    start = datetime(day.year, day.month, day.day)
+    return start.isoformat(), (start + timedelta(days=1)).isoformat()
+
+
+class SelectedToday:
+    """
+    Per-channel set of users already picked to brew today. Each channel's set is loaded
+    once per UTC day with a date-bounded query and then kept current by
+    log_selected_brewer; it is reloaded after `ttl` seconds to pick up other processes.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._sets = {}
+        self._lock = threading.Lock()
+
+    def get(self, channel_id, loader):
+        """
+        Return the user IDs picked today in a channel. `loader(start, end)` fetches the
+        IDs selected between two ISO timestamps when the set is missing or stale.
+        """
+        today = datetime.utcnow().date()
+        with self._lock:
+            entry = self._sets.get(channel_id)
+            if entry and entry["day"] == today and time.monotonic() - entry["loaded_at"] < self.ttl:
+                return entry["user_ids"]
+
+        user_ids = set(loader(*utc_day_bounds(today)))
+        with self._lock:
+            self._sets[channel_id] = {"day": today, "loaded_at": time.monotonic(), "user_ids": user_ids}
+        return user_ids
+
+    def add(self, channel_id, user_id):
+        today = datetime.utcnow().date()
+        with self._lock:
+            entry = self._sets.get(channel_id)
+            if entry and entry["day"] == today:
+                entry["user_ids"].add(user_id)
+
+
+selected_today = SelectedToday()
+
+
+STRATEGIES = ("uniform", "least_recent", "deficit")
+
+
+class Availability:
+    """
+    A weekly window, in UTC, during which a user can be picked to brew. Missing
+    hours mean the whole day.
+    """
+
+    def __init__(self, weekdays, start_hour, end_hour):
+        self.weekdays = set(weekdays)  # 0 = Monday
+        self.start_hour = 0 if start_hour is None else start_hour
+        self.end_hour = 24 if end_hour is None else end_hour
+
+    def contains(self, moment):
+        return moment.weekday() in self.weekdays and self.start_hour <= moment.hour < self.end_hour
+
+
+class BrewerPool:
+    """
+    Selection state for one channel, updated incrementally so each pick costs O(log n).
+
+    Two Fenwick trees over member slots hold, for active members, an indicator and
+    their brew count. The deficit weight of a member is (max_count + 1 - count), so
+    the weight of any prefix is (max_count + 1) * active - counts and can be searched
+    in O(log n) without touching every member when max_count moves. A heap ordered
+    by last brew/selection time serves least-recently-brewed picks.
+
+    A member is active while they are on the roster, have not opted out and are
+    inside their availability window. The roster is re-applied only when its version
+    changes, and availability only when the hour does, for the members it affects.
+    """
+
+    def __init__(self):
+        self.slots = {}
+        self.user_ids = [None]  # 1-based to match the trees
+        self.users = {}
+        self.counts = {}
+        self.last_active = {}
+        self.active = set()
+        self.max_count = 0
+        self.roster_version = None
+        self.availability_key = None
+        self.unavailable = set()
+        self._active_tree = [0]
+        self._count_tree = [0]
+        self._heap = []
+
+    def _add(self, tree, index, delta):
+        while index < len(tree):
+            tree[index] += delta
+            index += index & -index
+
+    def _prefix(self, tree, index):
+        total = 0
+        while index > 0:
+            total += tree[index]
+            index -= index & -index
+        return total
+
+    def _slot(self, user_id):
+        index = self.slots.get(user_id)
+        if index is None:
+            # Appending to a Fenwick tree: the new node covers (index - lowbit, index]
+            index = len(self.user_ids)
+            self.slots[user_id] = index
+            self.user_ids.append(user_id)
+            low = index - (index & -index)
+            for tree in (self._active_tree, self._count_tree):
+                tree.append(self._prefix(tree, index - 1) - self._prefix(tree, low))
+        return index
+
+    def set_active(self, user_id, active):
+        index = self._slot(user_id)
+        if active == (user_id in self.active):
+            return
+
+        sign = 1 if active else -1
+        self._add(self._active_tree, index, sign)
+        self._add(self._count_tree, index, sign * self.counts.get(user_id, 0))
+        if active:
+            self.active.add(user_id)
+            self._push(user_id)
+        else:
+            self.active.discard(user_id)
+
+    def add_count(self, user_id, delta=1):
+        index = self._slot(user_id)
+        self.counts[user_id] = self.counts.get(user_id, 0) + delta
+        self.max_count = max(self.max_count, self.counts[user_id])
+        if user_id in self.active:
+            self._add(self._count_tree, index, delta)
+
+    def touch(self, user_id, timestamp):
+        if timestamp <= self.last_active.get(user_id, 0.0):
+            return
+        self.last_active[user_id] = timestamp
+        if user_id in self.active:
+            self._push(user_id)
+
+    def _push(self, user_id):
+        heapq.heappush(self._heap, (self.last_active.get(user_id, 0.0), user_id))
+        # Stale entries are skipped lazily; compact once they dominate the heap
+        if len(self._heap) > 4 * len(self.active) + 64:
+            self._heap = [(self.last_active.get(active_id, 0.0), active_id) for active_id in self.active]
+            heapq.heapify(self._heap)
+
+    def eligible(self, user_id, opted_out):
+        return user_id in self.users and user_id not in opted_out and user_id not in self.unavailable
+
+    def sync_roster(self, users, version, opted_out):
+        """
+        Activate current channel members and deactivate those who left.
+        Only does work when the roster's `version` has changed.
+        """
+        if version is not None and version == self.roster_version:
+            return
+        self.roster_version = version
+        self.users = {user["id"]: user for user in users}
+
+        for user_id in list(self.active):
+            if user_id not in self.users:
+                self.set_active(user_id, False)
+        for user_id in self.users:
+            self.set_active(user_id, self.eligible(user_id, opted_out))
+
+    def sync_availability(self, key, unavailable, opted_out):
+        """
+        Apply the set of users outside their availability window for `key`, updating
+        only the members whose availability changed.
+        """
+        if key == self.availability_key:
+            return
+        changed = self.unavailable ^ unavailable
+        self.availability_key, self.unavailable = key, unavailable
+        for user_id in changed:
+            if user_id in self.users:
+                self.set_active(user_id, self.eligible(user_id, opted_out))
+
+    def _descend(self, target, weight_of):
+        """
+        Find the slot whose cumulative weight first exceeds `target`.
+        """
+        position = 0
+        step = 1 << (len(self.user_ids) - 1).bit_length()
+        while step:
+            node = position + step
+            if node < len(self.user_ids):
+                weight = weight_of(node)
+                if weight <= target:
+                    target -= weight
+                    position = node
+            step >>= 1
+        return self.user_ids[position + 1]
+
+    def pick_weighted(self, rng, strategy):
+        if strategy == "deficit":
+            ceiling = self.max_count + 1
+            weight_of = lambda node: ceiling * self._active_tree[node] - self._count_tree[node]
+        else:
+            weight_of = lambda node: self._active_tree[node]
+
+        size = len(self.user_ids) - 1
+        total = self._prefix(self._active_tree, size)
+        if strategy == "deficit":
+            total = (self.max_count + 1) * total - self._prefix(self._count_tree, size)
+        if total <= 0:
+            return None
+        return self._descend(rng.random() * total, weight_of)
+
+    def pick_least_recent(self, excluded):
+        skipped = []
+        picked = None
+        while self._heap:
+            timestamp, user_id = heapq.heappop(self._heap)
+            if user_id not in self.active or self.last_active.get(user_id, 0.0) != timestamp:
+                continue  # stale entry
+            skipped.append((timestamp, user_id))
+            if user_id not in excluded:
+                picked = user_id
+                break
+
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return picked
+
+
+class SelectionEngine:
+    """
+    Picks brewers per channel with a pluggable strategy:
+
+    - uniform: every eligible member equally likely (the original behaviour)
+    - least_recent: the member who brewed or was picked longest ago
+    - deficit: weighted towards members who have brewed least
+
+    Members who opted out, are outside their availability window, or were already
+    picked today are never chosen.
+    """
+
+    def __init__(self, strategy="uniform", rng=None, availability_ttl=300):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown selection strategy: {strategy}")
+        self.strategy = strategy
+        self.rng = rng or random.Random()
+        self.opted_out = set()
+        self.availability = {}
+        self.availability_ttl = availability_ttl
+        self.availability_loaded_at = None
+        self.availability_generation = 0
+        self._unavailable_key = None
+        self._unavailable = set()
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def availability_is_stale(self):
+        return (
+            self.availability_loaded_at is None
+            or time.monotonic() - self.availability_loaded_at > self.availability_ttl
+        )
+
+    def load_availability(self, rows):
+        """
+        Load opt-outs and availability windows from brewer_availability rows.
+        """
+        opted_out = {row["user_id"] for row in rows if row.get("opted_out")}
+        with self._lock:
+            changed = self.opted_out ^ opted_out
+            self.opted_out = opted_out
+            self.availability = {
+                row["user_id"]: Availability(row["weekdays"], row.get("start_hour"), row.get("end_hour"))
+                for row in rows if row.get("weekdays") is not None
+            }
+            self.availability_loaded_at = time.monotonic()
+            # Windows are re-evaluated on the next pick
+            self.availability_generation += 1
+            for pool in self._pools.values():
+                for user_id in changed:
+                    if user_id in pool.users:
+                        pool.set_active(user_id, pool.eligible(user_id, opted_out))
+
+    def _unavailable_now(self, now):
+        """
+        (key, user IDs outside their availability window). Windows open and close on
+        the hour, so the windows are only scanned once per hour or after a reload.
+        """
+        key = (self.availability_generation, now.date(), now.hour)
+        if key != self._unavailable_key:
+            self._unavailable = {
+                user_id for user_id, window in self.availability.items() if not window.contains(now)
+            }
+            self._unavailable_key = key
+        return key, self._unavailable
+
+    def set_opted_out(self, user_id, opted_out):
+        with self._lock:
+            if opted_out:
+                self.opted_out.add(user_id)
+            else:
+                self.opted_out.discard(user_id)
+            for pool in self._pools.values():
+                if user_id in pool.users:
+                    pool.set_active(user_id, pool.eligible(user_id, self.opted_out))
+
+    def _pool(self, channel_id, stats_loader):
+        pool = self._pools.get(channel_id)
+        if pool is None:
+            pool = BrewerPool()
+            for row in stats_loader():
+                pool.add_count(row["user_id"], row["brews"])
+                if row.get("last_active"):
+                    pool.touch(row["user_id"], to_epoch(row["last_active"]))
+            self._pools[channel_id] = pool
+        return pool
+
+    def pick(self, channel_id, users, excluded, stats_loader, roster_version=None):
+        """
+        Pick one user record from `users`, never one whose ID is in `excluded`.
+        `stats_loader()` returns per-user brew counts and last activity the first
+        time a channel is seen; afterwards the pool is kept current by record_*.
+        `users` is only re-applied when `roster_version` changes (always, if it is None).
+        """
+        now = datetime.utcnow()
+        with self._lock:
+            pool = self._pool(channel_id, stats_loader)
+            pool.sync_roster(users, roster_version, self.opted_out)
+            pool.sync_availability(*self._unavailable_now(now), self.opted_out)
+
+            excluded = set(excluded) & pool.active
+
+            if self.strategy == "least_recent":
+                user_id = pool.pick_least_recent(excluded)
+            else:
+                for user_id in excluded:
+                    pool.set_active(user_id, False)
+                try:
+                    user_id = pool.pick_weighted(self.rng, self.strategy)
+                finally:
+                    for excluded_id in excluded:
+                        pool.set_active(excluded_id, True)
+
+            return pool.users.get(user_id) if user_id else None
+
+    def record_brew(self, channel_id, user_id, timestamp):
+        with self._lock:
+            pool = self._pools.get(channel_id)
+            if pool:
+                pool.add_count(user_id)
+                pool.touch(user_id, to_epoch(timestamp))
+
+    def record_selection(self, channel_id, user_id, timestamp):
+        with self._lock:
+            pool = self._pools.get(channel_id)
+            if pool:
+                pool.touch(user_id, to_epoch(timestamp))
+
+
+selection_engine = SelectionEngine(BREWER_SELECTION_STRATEGY)
@@ -0,0 +1,246 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import SLACK_BOT_TOKEN, SLACK_API_URL, SLACK_RATE_LIMITING, SLACK_TIMEOUT
+from app.metrics import metrics
+from app.resilience import breaker
+
+# Requests per minute allowed by each Slack Web API rate limit tier
+TIER_LIMITS = {
+    1: 1,
+    2: 20,
+    3: 50,
+    4: 100,
+}
+
+METHOD_TIERS = {
+    "conversations.members": 4,
+    "users.info": 4,
+    "users.list": 2,
+    "chat.update": 3,
+}
+
+# chat.postMessage is "special": roughly one message per second per channel
+POST_MESSAGE_RATE = 1.0
+POST_MESSAGE_BURST = 5
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    A blocking token bucket refilled at `rate` tokens per second up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token and return how long to wait before using it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+
+class UnlimitedBucket:
+    def reserve(self):
+        return 0.0
+
+    def acquire(self):
+        pass
+
+
+class RateLimiter:
+    """
+    One token bucket per Web API method (per channel for chat.postMessage),
+    sized to Slack's rate limit tiers.
+    """
+
+    def __init__(self, enabled=SLACK_RATE_LIMITING):
+        self.enabled = enabled
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, method, channel=None):
+        if not self.enabled:
+            return UnlimitedBucket()
+
+        key = (method, channel) if method == "chat.postMessage" else method
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if method == "chat.postMessage":
+                    bucket = TokenBucket(POST_MESSAGE_RATE, POST_MESSAGE_BURST)
+                else:
+                    per_minute = TIER_LIMITS[METHOD_TIERS.get(method, 3)]
+                    bucket = TokenBucket(per_minute / 60.0, max(1, per_minute // 10))
+                self._buckets[key] = bucket
+            return bucket
+
+
+def backoff(attempt, status_code=None, retry_after=None):
+    """
+    Seconds to wait before the next attempt; honours Retry-After on 429s.
+    """
+    if status_code == 429:
+        return float(retry_after or 1) + random.uniform(0, 1)
+    return random.uniform(0, min(8, 0.5 * 2 ** attempt))
+
+
+class SlackClient:
+    """
+    Slack Web API client sharing one keep-alive connection pool, with per-method
+    rate limiting and jittered retries on 429 and 5xx responses. Every request has a
+    timeout, and all workspaces share the "slack" circuit breaker.
+    """
+
+    def __init__(self, token, base_url=SLACK_API_URL, max_retries=3, pool_size=20, limiter=None,
+                 timeout=SLACK_TIMEOUT):
+        self.token = token
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.limiter = limiter or RateLimiter()
+        self.timeout = timeout
+        self.breaker = breaker("slack")
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """
+        The shared keep-alive session, created on first use so importing this module
+        does not pull in requests.
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def request(self, http_method, url, **kwargs):
+        """
+        Send a request through the shared session, retrying on 429/5xx and connection errors.
+        A read timeout is not retried, since Slack may already have acted on the request.
+        """
+        session = self.session
+        import requests
+
+        kwargs.setdefault("timeout", self.timeout)
+        with self.breaker.guard() as call:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = session.request(http_method, url, **kwargs)
+                except requests.ConnectionError as e:
+                    if attempt == self.max_retries:
+                        raise
+                    print(f"Slack connection error, retrying: {e}")
+                    time.sleep(backoff(attempt))
+                    continue
+
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    if response.status_code >= 500:
+                        call["failed"], call["error"] = True, f"HTTP {response.status_code}"
+                    return response
+
+                print(f"Slack returned {response.status_code} for {url}, retrying")
+                time.sleep(backoff(attempt, response.status_code, response.headers.get("Retry-After")))
+
+    def call(self, method, params=None, json=None, http_method="POST"):
+        """
+        Call a Web API method and return the decoded JSON body.
+        """
+        channel = (json or params or {}).get("channel")
+        self.limiter.bucket(method, channel).acquire()
+
+        with metrics.span("slack", method) as span:
+            response = self.request(
+                http_method,
+                f"{self.base_url}/{method}",
+                headers={"Authorization": f"Bearer {self.token}"},
+                params=params,
+                json=json
+            )
+
+            try:
+                body = response.json()
+            except ValueError:
+                body = {"ok": False, "error": f"HTTP {response.status_code}: {response.text}"}
+            span["error"] = not body.get("ok")
+        return body
+
+    def paginate(self, method, params, key):
+        """
+        Follow Slack cursor pagination and yield every item stored under `key`.
+        """
+        params = dict(params, limit=1000)
+        while True:
+            response = self.call(method, params=params, http_method="GET")
+            if not response.get("ok"):
+                print(f"Error calling {method}: {response}")
+                return
+
+            yield from response.get(key, [])
+
+            cursor = (response.get("response_metadata") or {}).get("next_cursor")
+            if not cursor:
+                return
+            params["cursor"] = cursor
+
+    def post_message(self, channel, text):
+        return self.call("chat.postMessage", json={"channel": channel, "text": text})
+
+    def update_message(self, channel, ts, text):
+        return self.call("chat.update", json={"channel": channel, "ts": ts, "text": text})
+
+    def post_messages(self, messages, max_workers=4):
+        """
+        Post a batch of (channel, text) messages concurrently, preserving order per result.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(lambda message: self.post_message(*message), messages))
+
+    def users_info(self, user_id):
+        return self.call("users.info", params={"user": user_id}, http_method="GET")
+
+    def users_info_many(self, user_ids, max_workers=4):
+        """
+        Look up several users concurrently over the shared pool. Returns {user_id: response}.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return dict(zip(user_ids, pool.map(self.users_info, user_ids)))
+
+    def post_response(self, response_url, payload):
+        """
+        Deliver a payload to a slash command's response_url over the shared pool.
+        """
+        with metrics.span("slack", "response_url") as span:
+            response = self.request("POST", response_url, json=payload)
+            span["error"] = response.status_code >= 400
+        return response
+
+
+slack = SlackClient(SLACK_BOT_TOKEN)
@@ -0,0 +1,297 @@
+-- SQLite port of Documentation/supabase/supabase_setup.sql, applied by app/sqlite_store.py
+-- on start-up. UUIDs and JSON are stored as TEXT, booleans as 0/1 and timestamps as ISO 8601
+-- strings, which sort and compare in time order.
+
+-- Tables
+CREATE TABLE IF NOT EXISTS brewing_logs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    user_name TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    channel TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS selected_brewers (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    user_name TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+
+-- Serves the "already picked today" lookup in pick_random_brewer
+CREATE INDEX IF NOT EXISTS selected_brewers_channel_timestamp_idx ON selected_brewers (channel_id, timestamp);
+
+CREATE TABLE IF NOT EXISTS last_cup_logs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    user_name TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS brewing_jobs (
+    id TEXT PRIMARY KEY,
+    execute_at TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
+    brew_id TEXT NOT NULL,
+    status TEXT NOT NULL
+);
+
+-- Serves the scheduler's start-up load
+CREATE INDEX IF NOT EXISTS brewing_jobs_status_execute_at_idx ON brewing_jobs (status, execute_at);
+
+CREATE TABLE IF NOT EXISTS accusations (
+    id TEXT PRIMARY KEY,
+    accuser_id TEXT NOT NULL,
+    accuser_name TEXT NOT NULL,
+    accused_id TEXT NOT NULL,
+    accused_name TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    refuted INTEGER DEFAULT 0,
+    judged INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS refutations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    accusation_id TEXT NOT NULL REFERENCES accusations(id) ON DELETE CASCADE,
+    accused_id TEXT NOT NULL,
+    accused_name TEXT NOT NULL,
+    channel_id TEXT NOT NULL,
+    timestamp TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS votes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    accusation_id TEXT NOT NULL REFERENCES accusations(id) ON DELETE CASCADE,
+    voter_id TEXT NOT NULL,
+    voter_name TEXT NOT NULL,
+    vote TEXT CHECK (vote IN ('accept', 'reject')),
+    timestamp TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
+    CONSTRAINT unique_vote UNIQUE (accusation_id, voter_id)
+);
+
+CREATE TABLE IF NOT EXISTS restock_logs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    user_name TEXT NOT NULL,
+    item TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    points INTEGER NOT NULL,
+    timestamp TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+);
+
+-- Opt-outs and weekly UTC availability windows for /pick-brewer (weekdays: JSON array, 0 = Monday)
+CREATE TABLE IF NOT EXISTS brewer_availability (
+    user_id TEXT PRIMARY KEY,
+    opted_out INTEGER NOT NULL DEFAULT 0,
+    weekdays TEXT,
+    start_hour INTEGER,
+    end_hour INTEGER
+);
+
+-- Per-user counters for each leaderboard, maintained by the *_counters triggers.
+-- period is 'YYYY-MM' for a month or 'all' for all time.
+CREATE TABLE IF NOT EXISTS leaderboard_counters (
+    board TEXT NOT NULL,
+    period TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    user_name TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    CONSTRAINT leaderboard_counters_pkey PRIMARY KEY (board, period, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS leaderboard_counters_rank_idx ON leaderboard_counters (board, period, count DESC);
+
+-- Responses already sent for each Slack trigger_id / event_id, so retried requests are not handled twice
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    id TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+);
+
+-- Keyset pagination for app/export.py: rows are read in (timestamp, id) order, optionally per channel
+CREATE INDEX IF NOT EXISTS brewing_logs_export_idx ON brewing_logs (channel, timestamp, id);
+CREATE INDEX IF NOT EXISTS last_cup_logs_export_idx ON last_cup_logs (channel_id, timestamp, id);
+CREATE INDEX IF NOT EXISTS accusations_export_idx ON accusations (channel_id, timestamp, id);
+CREATE INDEX IF NOT EXISTS restock_logs_export_idx ON restock_logs (timestamp, id);
+CREATE INDEX IF NOT EXISTS votes_export_idx ON votes (timestamp, id);
+
+-- Winners of each closed month, frozen by the month-close job (board: 'brew' or 'restock', month: 'YYYY-MM')
+CREATE TABLE IF NOT EXISTS monthly_winner_snapshots (
+    board TEXT NOT NULL,
+    month TEXT NOT NULL,
+    month_name TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    rankings TEXT NOT NULL,
+    closed_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
+    CONSTRAINT monthly_winner_snapshots_pkey PRIMARY KEY (board, month)
+);
+
+-- Serves the month-close ranking of brewing_logs, which reads one month at a time
+CREATE INDEX IF NOT EXISTS brewing_logs_timestamp_idx ON brewing_logs (timestamp);
+
+-- Slack workspaces served by this deployment and their bot tokens
+CREATE TABLE IF NOT EXISTS workspaces (
+    team_id TEXT PRIMARY KEY,
+    name TEXT,
+    bot_token TEXT NOT NULL
+);
+
+-- One row per floor's coffee channel. Commands sent from elsewhere in a workspace go to its default channel.
+CREATE TABLE IF NOT EXISTS coffee_channels (
+    channel_id TEXT PRIMARY KEY,
+    team_id TEXT NOT NULL REFERENCES workspaces(team_id) ON DELETE CASCADE,
+    name TEXT,
+    is_default INTEGER NOT NULL DEFAULT 0
+);
+
+
+-- Views
+CREATE VIEW IF NOT EXISTS brew_leaderboard AS
+SELECT user_name, count AS brew_count
+FROM leaderboard_counters
+WHERE board = 'brew' AND period = strftime('%Y-%m', 'now') AND count > 0
+ORDER BY brew_count DESC;
+
+CREATE VIEW IF NOT EXISTS last_cup_leaderboard AS
+SELECT user_name, count AS times_last_cup
+FROM leaderboard_counters
+WHERE board = 'last_cup' AND period = 'all' AND count > 0
+ORDER BY times_last_cup DESC;
+
+CREATE VIEW IF NOT EXISTS accused_leaderboard AS
+SELECT user_name AS accused_name, count AS accusations
+FROM leaderboard_counters
+WHERE board = 'accused' AND period = 'all' AND count > 0
+ORDER BY accusations DESC;
+
+CREATE VIEW IF NOT EXISTS accuser_leaderboard AS
+SELECT user_name AS accuser_name, count AS accusations_made
+FROM leaderboard_counters
+WHERE board = 'accuser' AND period = 'all' AND count > 0
+ORDER BY accusations_made DESC;
+
+CREATE VIEW IF NOT EXISTS restock_leaderboard AS
+SELECT user_name, count
+FROM leaderboard_counters
+WHERE board = 'restock' AND period = strftime('%Y-%m', 'now') AND count > 0
+ORDER BY count DESC
+LIMIT 3;
+
+-- "Month YYYY" for a 'YYYY-MM' month, as to_char(month, 'Month YYYY') gives in Postgres
+CREATE VIEW IF NOT EXISTS month_names AS
+SELECT column1 AS number, column2 AS name FROM (VALUES
+    ('01', 'January'), ('02', 'February'), ('03', 'March'), ('04', 'April'),
+    ('05', 'May'), ('06', 'June'), ('07', 'July'), ('08', 'August'),
+    ('09', 'September'), ('10', 'October'), ('11', 'November'), ('12', 'December')
+);
+
+CREATE VIEW IF NOT EXISTS brewer_monthly_winners AS
+WITH monthly_brews AS (
+    SELECT user_name, strftime('%Y-%m', timestamp) AS month, COUNT(*) AS count
+    FROM brewing_logs
+    GROUP BY user_name, strftime('%Y-%m', timestamp)
+),
+ranked AS (
+    SELECT *, RANK() OVER (PARTITION BY month ORDER BY count DESC) AS rnk
+    FROM monthly_brews
+),
+winners AS (
+    SELECT month, count, user_name FROM ranked WHERE rnk = 1
+)
+SELECT
+    w.month,
+    n.name || ' ' || substr(w.month, 1, 4) AS month_name,
+    n.name || ' ' || substr(w.month, 1, 4) || ' - ' || group_concat(w.user_name, ', ') || ' with ' || w.count
+        || ' point' || CASE WHEN w.count = 1 THEN '' ELSE 's' END AS summary
+FROM winners w
+JOIN month_names n ON n.number = substr(w.month, 6, 2)
+GROUP BY w.month, w.count
+ORDER BY w.month;
+
+CREATE VIEW IF NOT EXISTS restock_monthly_winners AS
+WITH monthly_restocks AS (
+    SELECT user_name, strftime('%Y-%m', timestamp) AS month, SUM(points) AS count
+    FROM restock_logs
+    GROUP BY user_name, strftime('%Y-%m', timestamp)
+),
+ranked AS (
+    SELECT *, RANK() OVER (PARTITION BY month ORDER BY count DESC) AS rnk
+    FROM monthly_restocks
+),
+winners AS (
+    SELECT month, count, user_name FROM ranked WHERE rnk = 1
+)
+SELECT
+    w.month,
+    n.name || ' ' || substr(w.month, 1, 4) AS month_name,
+    n.name || ' ' || substr(w.month, 1, 4) || ' - ' || group_concat(w.user_name, ', ') || ' with ' || w.count
+        || ' point' || CASE WHEN w.count = 1 THEN '' ELSE 's' END AS summary
+FROM winners w
+JOIN month_names n ON n.number = substr(w.month, 6, 2)
+GROUP BY w.month, w.count
+ORDER BY w.month;
+
+
+-- Counter triggers, equivalent to bump_leaderboard_counter() in Postgres
+CREATE TRIGGER IF NOT EXISTS brewing_logs_counters AFTER INSERT ON brewing_logs
+BEGIN
+    INSERT INTO leaderboard_counters (board, period, user_id, user_name, count)
+    VALUES ('brew', strftime('%Y-%m', COALESCE(NEW.timestamp, 'now')), NEW.user_id, NEW.user_name, 1),
+           ('brew', 'all', NEW.user_id, NEW.user_name, 1)
+    ON CONFLICT (board, period, user_id) DO UPDATE
+    SET count = count + excluded.count, user_name = excluded.user_name;
+END;
+
+CREATE TRIGGER IF NOT EXISTS restock_logs_counters AFTER INSERT ON restock_logs
+BEGIN
+    INSERT INTO leaderboard_counters (board, period, user_id, user_name, count)
+    VALUES ('restock', strftime('%Y-%m', COALESCE(NEW.timestamp, 'now')), NEW.user_id, NEW.user_name, NEW.points),
+           ('restock', 'all', NEW.user_id, NEW.user_name, NEW.points)
+    ON CONFLICT (board, period, user_id) DO UPDATE
+    SET count = count + excluded.count, user_name = excluded.user_name;
+END;
+
+CREATE TRIGGER IF NOT EXISTS last_cup_logs_counters AFTER INSERT ON last_cup_logs
+BEGIN
+    INSERT INTO leaderboard_counters (board, period, user_id, user_name, count)
+    VALUES ('last_cup', strftime('%Y-%m', COALESCE(NEW.timestamp, 'now')), NEW.user_id, NEW.user_name, 1),
+           ('last_cup', 'all', NEW.user_id, NEW.user_name, 1)
+    ON CONFLICT (board, period, user_id) DO UPDATE
+    SET count = count + excluded.count, user_name = excluded.user_name;
+END;
+
+-- Accusations count for the accuser always, and against the accused unless refuted
+CREATE TRIGGER IF NOT EXISTS accusations_accuser_counters AFTER INSERT ON accusations
+BEGIN
+    INSERT INTO leaderboard_counters (board, period, user_id, user_name, count)
+    VALUES ('accuser', strftime('%Y-%m', COALESCE(NEW.timestamp, 'now')), NEW.accuser_id, NEW.accuser_name, 1),
+           ('accuser', 'all', NEW.accuser_id, NEW.accuser_name, 1)
+    ON CONFLICT (board, period, user_id) DO UPDATE
+    SET count = count + excluded.count, user_name = excluded.user_name;
+END;
+
+CREATE TRIGGER IF NOT EXISTS accusations_accused_counters AFTER INSERT ON accusations
+WHEN NOT NEW.refuted
+BEGIN
+    INSERT INTO leaderboard_counters (board, period, user_id, user_name, count)
+    VALUES ('accused', strftime('%Y-%m', COALESCE(NEW.timestamp, 'now')), NEW.accused_id, NEW.accused_name, 1),
+           ('accused', 'all', NEW.accused_id, NEW.accused_name, 1)
+    ON CONFLICT (board, period, user_id) DO UPDATE
+    SET count = count + excluded.count, user_name = excluded.user_name;
+END;
+
+CREATE TRIGGER IF NOT EXISTS accusations_refuted_counters AFTER UPDATE OF refuted ON accusations
+WHEN NEW.refuted IS NOT OLD.refuted
+BEGIN
+    INSERT INTO leaderboard_counters (board, period, user_id, user_name, count)
+    VALUES ('accused', strftime('%Y-%m', COALESCE(NEW.timestamp, 'now')), NEW.accused_id, NEW.accused_name,
+            CASE WHEN NEW.refuted THEN -1 ELSE 1 END),
+           ('accused', 'all', NEW.accused_id, NEW.accused_name, CASE WHEN NEW.refuted THEN -1 ELSE 1 END)
+    ON CONFLICT (board, period, user_id) DO UPDATE
+    SET count = count + excluded.count, user_name = excluded.user_name;
+END;
@@ -0,0 +1,351 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from app.leaderboard import COUNTER_BOARDS, SNAPSHOT_RANKS, current_month
+from app.metrics import metrics
+from app.storage import Store
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "sqlite_schema.sql")
+
+# Columns stored as JSON text or 0/1 integers, decoded back on read
+JSON_COLUMNS = {"payload", "response", "weekdays", "rankings"}
+BOOLEAN_COLUMNS = {"refuted", "judged", "opted_out", "is_default"}
+
+
+def _decode_row(cursor, row):
+    record = {}
+    for column, value in zip(cursor.description, row):
+        name = column[0]
+        if value is not None:
+            if name in JSON_COLUMNS:
+                value = json.loads(value)
+            elif name in BOOLEAN_COLUMNS:
+                value = bool(value)
+        record[name] = value
+    return record
+
+
+def _encode(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+class SQLiteStore(Store):
+    """
+    Keeps the bot's tables in a local SQLite file, with the schema, indexes, views
+    and counter triggers of supabase_setup.sql (see sqlite_schema.sql). The database
+    runs in WAL mode, so readers never wait for the writer, and each thread has its
+    own connection.
+    """
+
+    def __init__(self, path, busy_timeout=5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        connection = self._connection()
+        with open(SCHEMA_PATH) as schema:
+            connection.executescript(schema.read())
+
+        # Column names and types of every table and view, which also whitelists table names in SQL
+        tables = [row["name"] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'"
+        )]
+        self._columns = {
+            table: {row["name"]: row["type"] for row in connection.execute(f"PRAGMA table_info({table})")}
+            for table in tables
+        }
+        self.cleanup()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            connection.row_factory = _decode_row
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _query(self, operation, write=False):
+        """
+        A connection for one timed operation. Writes run in an immediate transaction,
+        which takes the write lock up front instead of failing on upgrade.
+        """
+        with metrics.span("sqlite", operation):
+            connection = self._connection()
+            if not write:
+                yield connection
+                return
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def _table(self, table):
+        if table not in self._columns:
+            raise ValueError(f"Unknown table {table!r}")
+        return self._columns[table]
+
+    def cleanup(self):
+        """
+        Delete processed follow-up jobs and idempotency keys older than a day. Supabase
+        does this with cron jobs; here it runs when the store is opened.
+        """
+        cutoff = (datetime.utcnow() - timedelta(days=1)).isoformat()
+        with self._query("cleanup", write=True) as connection:
+            connection.execute("DELETE FROM brewing_jobs WHERE status = 'processed' AND execute_at < ?", (cutoff,))
+            connection.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (cutoff,))
+
+    def insert_rows(self, table, rows):
+        columns = self._table(table)
+        generate_ids = columns.get("id") == "TEXT"
+        ignore_duplicates = all("id" in row for row in rows)
+
+        stored = []
+        with self._query(f"insert {table}", write=True) as connection:
+            for row in rows:
+                if generate_ids and "id" not in row:
+                    row = {"id": str(uuid4()), **row}
+                names = [name for name in row if name in columns]
+                sql = (f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+                       f"{' ON CONFLICT DO NOTHING' if ignore_duplicates else ''} RETURNING *")
+                stored.extend(connection.execute(sql, [_encode(row[name]) for name in names]).fetchall())
+        return stored
+
+    def idempotent_response(self, key):
+        with self._query("select idempotency_keys") as connection:
+            row = connection.execute("SELECT response FROM idempotency_keys WHERE id = ?", (key,)).fetchone()
+        return row["response"] if row else None
+
+    def pending_brewing_jobs(self):
+        with self._query("select brewing_jobs") as connection:
+            return connection.execute(
+                "SELECT id, execute_at, payload, channel FROM brewing_jobs WHERE status = 'pending'"
+            ).fetchall()
+
+    def claim_brewing_job(self, job_id):
+        with self._query("claim brewing_jobs", write=True) as connection:
+            cursor = connection.execute(
+                "UPDATE brewing_jobs SET status = 'processing' WHERE id = ? AND status = 'pending'", (job_id,)
+            )
+            return cursor.rowcount > 0
+
+    def finish_brewing_job(self, job_id, status):
+        with self._query("update brewing_jobs", write=True) as connection:
+            connection.execute("UPDATE brewing_jobs SET status = ? WHERE id = ?", (status, job_id))
+
+    def tenants(self):
+        with self._query("select tenants") as connection:
+            workspaces = connection.execute("SELECT team_id, bot_token FROM workspaces").fetchall()
+            channels = connection.execute("SELECT channel_id, team_id, is_default FROM coffee_channels").fetchall()
+        return workspaces, channels
+
+    def brewer_stats(self, channel_id):
+        with self._query("get_brewer_stats") as connection:
+            return connection.execute("""
+                SELECT user_id, SUM(kind = 'brew') AS brews, MAX(timestamp) AS last_active
+                FROM (
+                    SELECT user_id, timestamp, 'brew' AS kind FROM brewing_logs WHERE channel = ?
+                    UNION ALL
+                    SELECT user_id, timestamp, 'selected' FROM selected_brewers WHERE channel_id = ?
+                )
+                GROUP BY user_id
+            """, (channel_id, channel_id)).fetchall()
+
+    def brewer_availability(self):
+        with self._query("select brewer_availability") as connection:
+            return connection.execute(
+                "SELECT user_id, opted_out, weekdays, start_hour, end_hour FROM brewer_availability"
+            ).fetchall()
+
+    def set_brewer_opt_out(self, user_id, opted_out):
+        with self._query("upsert brewer_availability", write=True) as connection:
+            connection.execute("""
+                INSERT INTO brewer_availability (user_id, opted_out) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET opted_out = excluded.opted_out
+            """, (user_id, opted_out))
+
+    def selected_brewer_ids(self, channel_id, start, end):
+        with self._query("select selected_brewers") as connection:
+            rows = connection.execute(
+                "SELECT user_id FROM selected_brewers WHERE channel_id = ? AND timestamp >= ? AND timestamp < ?",
+                (channel_id, start, end)
+            ).fetchall()
+        return [row["user_id"] for row in rows]
+
+    def leaderboard_counters(self, periods):
+        with self._query("select leaderboard_counters") as connection:
+            return connection.execute(
+                f"SELECT board, period, user_id, user_name, count FROM leaderboard_counters "
+                f"WHERE period IN ({', '.join('?' * len(periods))}) ORDER BY board, period, user_id",
+                list(periods)
+            ).fetchall()
+
+    def monthly_winners(self, view):
+        self._table(view)
+        with self._query(f"select {view}") as connection:
+            return connection.execute(f"SELECT month_name, summary FROM {view} ORDER BY month").fetchall()
+
+    def winner_snapshots(self, board):
+        with self._query("select monthly_winner_snapshots") as connection:
+            return connection.execute(
+                "SELECT month, month_name, summary, rankings FROM monthly_winner_snapshots WHERE board = ? ORDER BY month",
+                (board,)
+            ).fetchall()
+
+    def monthly_rankings(self, board, start, end):
+        table, amount = {"brew": ("brewing_logs", "1"), "restock": ("restock_logs", "points")}[board]
+        # Bare YYYY-MM bounds compare correctly against ISO timestamps
+        with self._query("monthly_rankings") as connection:
+            return connection.execute(f"""
+                SELECT month, user_name, count, rank FROM (
+                    SELECT month, user_name, count, RANK() OVER (PARTITION BY month ORDER BY count DESC) AS rank
+                    FROM (
+                        SELECT strftime('%Y-%m', timestamp) AS month, user_name, SUM({amount}) AS count
+                        FROM {table}
+                        WHERE timestamp >= ? AND timestamp < ?
+                        GROUP BY month, user_name
+                    )
+                )
+                WHERE rank <= ?
+                ORDER BY month, rank, user_name
+            """, (start or "", end, SNAPSHOT_RANKS)).fetchall()
+
+    def save_winner_snapshots(self, rows):
+        with self._query("insert monthly_winner_snapshots", write=True) as connection:
+            connection.executemany("""
+                INSERT INTO monthly_winner_snapshots (board, month, month_name, summary, rankings, closed_at)
+                VALUES (:board, :month, :month_name, :summary, :rankings, :closed_at)
+                ON CONFLICT (board, month) DO NOTHING
+            """, [dict(row, rankings=json.dumps(row["rankings"])) for row in rows])
+
+    def leaderboard(self, board_type, limit):
+        if board_type not in COUNTER_BOARDS:
+            raise ValueError(f"Unknown leaderboard type: {board_type}")
+        board, period = COUNTER_BOARDS[board_type]
+        with self._query("get_leaderboard") as connection:
+            return connection.execute("""
+                SELECT user_name, count FROM leaderboard_counters
+                WHERE board = ? AND period = ? AND count > 0
+                ORDER BY count DESC LIMIT ?
+            """, (board, current_month() if period == "month" else period, limit)).fetchall()
+
+    def rebuild_leaderboard_counters(self):
+        with self._query("rebuild_leaderboard_counters", write=True) as connection:
+            connection.execute("DELETE FROM leaderboard_counters")
+            # With MAX(), SQLite takes the bare user_name column from the latest row of each group
+            connection.execute("""
+                INSERT INTO leaderboard_counters (board, period, user_id, user_name, count)
+                WITH events AS (
+                    SELECT 'brew' AS board, timestamp, user_id, user_name, 1 AS amount FROM brewing_logs
+                    UNION ALL
+                    SELECT 'restock', timestamp, user_id, user_name, points FROM restock_logs
+                    UNION ALL
+                    SELECT 'last_cup', timestamp, user_id, user_name, 1 FROM last_cup_logs
+                    UNION ALL
+                    SELECT 'accuser', timestamp, accuser_id, accuser_name, 1 FROM accusations
+                    UNION ALL
+                    SELECT 'accused', timestamp, accused_id, accused_name, 1 FROM accusations WHERE NOT refuted
+                ),
+                periods AS (
+                    SELECT board, strftime('%Y-%m', timestamp) AS period, user_id, user_name, amount, timestamp FROM events
+                    UNION ALL
+                    SELECT board, 'all', user_id, user_name, amount, timestamp FROM events
+                )
+                SELECT board, period, user_id, user_name, total FROM (
+                    SELECT board, period, user_id, user_name, MAX(timestamp), SUM(amount) AS total
+                    FROM periods
+                    GROUP BY board, period, user_id
+                )
+            """)
+
+    def refute_latest_accusation(self, channel_id, since):
+        with self._query("refute_latest_accusation", write=True) as connection:
+            accusation = connection.execute(
+                "SELECT * FROM accusations WHERE channel_id = ? AND timestamp >= ? AND judged = 0 "
+                "ORDER BY timestamp DESC LIMIT 1", (channel_id, since)
+            ).fetchone()
+            if accusation:
+                connection.execute(
+                    "INSERT INTO refutations (accusation_id, accused_id, accused_name, channel_id, timestamp) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (accusation["id"], accusation["accused_id"], accusation["accused_name"], channel_id,
+                     datetime.utcnow().isoformat())
+                )
+        return accusation
+
+    def cast_vote(self, row):
+        names = list(row)
+        with self._query("cast_vote", write=True) as connection:
+            if not connection.execute("SELECT 1 FROM accusations WHERE id = ?", (row["accusation_id"],)).fetchone():
+                return "unknown"
+            stored = connection.execute(
+                f"INSERT INTO votes ({', '.join(names)}) VALUES ({', '.join('?' * len(names))}) "
+                f"ON CONFLICT (accusation_id, voter_id) DO NOTHING RETURNING id",
+                [row[name] for name in names]
+            ).fetchall()
+        return "recorded" if stored else "duplicate"
+
+    def close_accusation(self, accusation_id):
+        # The write transaction holds SQLite's lock, so two tallies can't interleave
+        with self._query("close_accusation", write=True) as connection:
+            accusation = connection.execute(
+                "SELECT accused_id, accused_name, channel_id, timestamp, refuted FROM accusations WHERE id = ?",
+                (accusation_id,)
+            ).fetchone()
+            if accusation is None:
+                return None
+
+            counts = connection.execute(
+                "SELECT COALESCE(SUM(vote = 'accept'), 0) AS accept, COALESCE(SUM(vote = 'reject'), 0) AS reject "
+                "FROM votes WHERE accusation_id = ?", (accusation_id,)
+            ).fetchone()
+            refuted = counts["reject"] > counts["accept"]
+            flipped = False
+            if counts["accept"] or counts["reject"]:
+                connection.execute(
+                    "UPDATE accusations SET judged = 1, refuted = ? WHERE id = ?", (refuted, accusation_id)
+                )
+                flipped = refuted != accusation["refuted"]
+            else:
+                refuted = accusation["refuted"]
+
+        return dict(accusation, **counts, refuted=refuted, flipped=flipped)
+
+    def export_page(self, table, columns, after=None, since=None, until=None,
+                    channel_column=None, channel=None, limit=1000):
+        known = self._table(table)
+        selected = [column for column in columns if column in known]
+        where, params = ["timestamp IS NOT NULL"], []
+        if since:
+            where.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            where.append("timestamp < ?")
+            params.append(until)
+        if channel:
+            if channel_column not in known:
+                raise ValueError(f"{table} has no column {channel_column!r}")
+            where.append(f"{channel_column} = ?")
+            params.append(channel)
+        if after is not None:
+            where.append("(timestamp > ? OR (timestamp = ? AND id > ?))")
+            params.extend([after["timestamp"], after["timestamp"], after["id"]])
+
+        with self._query(f"select {table}") as connection:
+            return connection.execute(
+                f"SELECT {', '.join(selected)} FROM {table} WHERE {' AND '.join(where)} "
+                f"ORDER BY timestamp, id LIMIT ?",
+                params + [limit]
+            ).fetchall()
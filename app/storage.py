@@ -0,0 +1,379 @@
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+from app.clients import LazyClient, supabase
+from app.config import STORAGE_BACKEND, SQLITE_PATH
+from app.leaderboard import SNAPSHOT_RANKS
+from app.resilience import breaker
+
+
+class Store(ABC):
+    """
+    The tables and queries the bot uses, independent of where they are kept.
+    SupabaseStore reads and writes Supabase through PostgREST; SQLiteStore
+    (app/sqlite_store.py) keeps the same schema in a local database file.
+    """
+
+    @abstractmethod
+    def insert_rows(self, table, rows):
+        """
+        Bulk insert rows into a table and return the stored rows. Rows that carry their own
+        id are inserted ignoring duplicates, so replaying the write spool is harmless.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def idempotent_response(self, key):
+        """
+        The response recorded for an idempotency key, or None.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def pending_brewing_jobs(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def claim_brewing_job(self, job_id):
+        """
+        Atomically move a job from pending to processing. Returns False if another
+        process has already claimed it.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def finish_brewing_job(self, job_id, status):
+        raise NotImplementedError
+
+    @abstractmethod
+    def tenants(self):
+        """
+        Returns the workspaces (team_id, bot_token) and coffee channels
+        (channel_id, team_id, is_default) served by this deployment.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def brewer_stats(self, channel_id):
+        """
+        Per-user brew counts and last brew/selection time in a channel.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def brewer_availability(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_brewer_opt_out(self, user_id, opted_out):
+        raise NotImplementedError
+
+    @abstractmethod
+    def selected_brewer_ids(self, channel_id, start, end):
+        """
+        IDs of users selected in a channel between two ISO timestamps.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def leaderboard_counters(self, periods):
+        """
+        Every leaderboard_counters row for the given periods.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def monthly_winners(self, view):
+        """
+        The (month_name, summary) rows of a monthly winner view, oldest month first.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def winner_snapshots(self, board):
+        """
+        The monthly_winner_snapshots rows for a board, oldest month first.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def monthly_rankings(self, board, start, end):
+        """
+        (month, user_name, count, rank) rows for the months from `start` (or the first
+        logged month when None) up to but excluding `end`, both YYYY-MM, keeping the top
+        SNAPSHOT_RANKS places of each month. Ordered by month, rank and name.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_winner_snapshots(self, rows):
+        """
+        Store snapshot rows, leaving any month that is already closed as it is.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def leaderboard(self, board_type, limit):
+        """
+        Top users of one leaderboard, read straight from the counters table.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def rebuild_leaderboard_counters(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def refute_latest_accusation(self, channel_id, since):
+        """
+        Log an anonymous refutation of the channel's most recent open accusation made at
+        or after an ISO timestamp, and return that accusation, or None if there is none.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def cast_vote(self, row):
+        """
+        Store a vote. Returns "recorded", "duplicate" if the voter has already voted on
+        the accusation, or "unknown" if there is no such accusation.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def close_accusation(self, accusation_id):
+        """
+        Tally an accusation's votes and record the verdict in one transaction, so two
+        tallies can't interleave. Returns the accusation's accused_id, accused_name,
+        channel_id and timestamp with the accept and reject counts, whether it is
+        refuted, and whether the verdict changed it (flipped); None if it doesn't exist.
+        An accusation without votes is left as it is.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def export_page(self, table, columns, after=None, since=None, until=None,
+                    channel_column=None, channel=None, limit=1000):
+        """
+        Up to `limit` rows with a timestamp in [since, until), in (timestamp, id) order,
+        starting after the row `after`.
+        """
+        raise NotImplementedError
+
+
+class SupabaseStore(Store):
+    def insert_rows(self, table, rows):
+        if all("id" in row for row in rows):
+            result = supabase.table(table).upsert(rows, ignore_duplicates=True, on_conflict="id").execute()
+        else:
+            result = supabase.table(table).insert(rows).execute()
+        return result.data
+
+    def idempotent_response(self, key):
+        response = supabase.table("idempotency_keys").select("response").eq("id", key).execute()
+        return response.data[0]["response"] if response.data else None
+
+    def pending_brewing_jobs(self):
+        response = supabase.table("brewing_jobs")\
+            .select("id, execute_at, payload, channel")\
+            .eq("status", "pending")\
+            .execute()
+        return response.data
+
+    def claim_brewing_job(self, job_id):
+        response = supabase.table("brewing_jobs")\
+            .update({"status": "processing"})\
+            .eq("id", job_id)\
+            .eq("status", "pending")\
+            .execute()
+        return bool(response.data)
+
+    def finish_brewing_job(self, job_id, status):
+        supabase.table("brewing_jobs").update({"status": status}).eq("id", job_id).execute()
+
+    def tenants(self):
+        workspaces = supabase.table("workspaces").select("team_id, bot_token").execute()
+        channels = supabase.table("coffee_channels").select("channel_id, team_id, is_default").execute()
+        return workspaces.data, channels.data
+
+    def brewer_stats(self, channel_id):
+        response = supabase.rpc("get_brewer_stats", {"p_channel_id": channel_id}).execute()
+        return response.data if response.data else []
+
+    def brewer_availability(self):
+        response = supabase.table("brewer_availability")\
+            .select("user_id, opted_out, weekdays, start_hour, end_hour")\
+            .execute()
+        return response.data
+
+    def set_brewer_opt_out(self, user_id, opted_out):
+        supabase.table("brewer_availability").upsert({
+            "user_id": user_id,
+            "opted_out": opted_out
+        }).execute()
+
+    def selected_brewer_ids(self, channel_id, start, end):
+        # Served by the selected_brewers (channel_id, timestamp) index
+        response = supabase.table("selected_brewers")\
+            .select("user_id")\
+            .eq("channel_id", channel_id)\
+            .gte("timestamp", start)\
+            .lt("timestamp", end)\
+            .execute()
+        return [row["user_id"] for row in response.data]
+
+    def leaderboard_counters(self, periods):
+        rows = []
+        page_size = 1000
+        while True:
+            page = supabase.table("leaderboard_counters")\
+                .select("board, period, user_id, user_name, count")\
+                .in_("period", periods)\
+                .order("board").order("period").order("user_id")\
+                .range(len(rows), len(rows) + page_size - 1)\
+                .execute()
+            rows.extend(page.data)
+            if len(page.data) < page_size:
+                return rows
+
+    def monthly_winners(self, view):
+        response = supabase.table(view).select("month_name, summary").order("month").execute()
+        return response.data if response.data else []
+
+    def winner_snapshots(self, board):
+        response = supabase.table("monthly_winner_snapshots")\
+            .select("month, month_name, summary, rankings")\
+            .eq("board", board)\
+            .order("month")\
+            .execute()
+        return response.data
+
+    def monthly_rankings(self, board, start, end):
+        rows = []
+        page_size = 1000
+        while True:
+            page = supabase.rpc("monthly_rankings", {
+                "p_board": board,
+                "p_start": f"{start}-01" if start else None,
+                "p_end": f"{end}-01",
+                "p_ranks": SNAPSHOT_RANKS,
+            }).order("month").order("rank").order("user_name")\
+                .range(len(rows), len(rows) + page_size - 1)\
+                .execute()
+            rows.extend(page.data)
+            if len(page.data) < page_size:
+                return rows
+
+    def save_winner_snapshots(self, rows):
+        supabase.table("monthly_winner_snapshots").upsert(
+            rows, ignore_duplicates=True, on_conflict="board,month"
+        ).execute()
+
+    def leaderboard(self, board_type, limit):
+        response = supabase.rpc("get_leaderboard", {"board_type": board_type, "row_limit": limit}).execute()
+        return response.data if response.data else []
+
+    def rebuild_leaderboard_counters(self):
+        supabase.rpc("rebuild_leaderboard_counters", {}).execute()
+
+    def refute_latest_accusation(self, channel_id, since):
+        response = supabase.rpc("refute_latest_accusation", {
+            "p_channel_id": channel_id,
+            "p_since": since,
+            "p_timestamp": datetime.utcnow().isoformat(),
+        }).execute()
+        return response.data[0] if response.data else None
+
+    def _vote_params(self, row):
+        return {f"p_{key}": value for key, value in row.items()}
+
+    def cast_vote(self, row):
+        return supabase.rpc("cast_vote", self._vote_params(row)).execute().data
+
+    def close_accusation(self, accusation_id):
+        response = supabase.rpc("close_accusation", {"p_accusation_id": accusation_id}).execute()
+        return response.data[0] if response.data else None
+
+    def export_page(self, table, columns, after=None, since=None, until=None,
+                    channel_column=None, channel=None, limit=1000):
+        query = supabase.table(table).select(",".join(columns)).filter("timestamp", "not.is", "null")
+        if since:
+            query = query.gte("timestamp", since)
+        if until:
+            query = query.lt("timestamp", until)
+        if channel:
+            query = query.eq(channel_column, channel)
+        if after is not None:
+            timestamp, row_id = after["timestamp"], after["id"]
+            query = query.or_(f'timestamp.gt."{timestamp}",and(timestamp.eq."{timestamp}",id.gt."{row_id}")')
+        return query.order("timestamp").order("id").limit(limit).execute().data
+
+
+# SQLSTATE classes PostgREST answers with a 4xx: bad input, constraint violations,
+# unknown objects and exceptions raised by the functions themselves
+CLIENT_SQLSTATE_CLASSES = ("22", "23", "42", "P0")
+
+
+def is_client_error(error):
+    """
+    True for errors caused by the request rather than the database, e.g. an ID that is
+    not a UUID. They say nothing about the database's health, so they don't count
+    against its circuit.
+    """
+    if isinstance(error, (sqlite3.IntegrityError, sqlite3.DataError, sqlite3.ProgrammingError)):
+        return True
+    # postgrest's APIError carries the SQLSTATE or PostgREST error code. PGRST1xx are
+    # malformed requests and PGRST2xx unknown tables, columns or functions.
+    code = getattr(error, "code", None)
+    if not isinstance(code, str):
+        return False
+    return code.startswith(("PGRST1", "PGRST2")) or code[:2] in CLIENT_SQLSTATE_CLASSES
+
+
+class GuardedStore:
+    """
+    Runs every call to a store through its backend's circuit breaker, so while the
+    database is failing, callers get CircuitOpenError at once instead of each
+    waiting out a timeout. Errors the request caused (is_client_error) are passed
+    through without counting as failures.
+    """
+
+    def __init__(self, store, name):
+        self.store = store
+        self.breaker = breaker(name)
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+        if not callable(method):
+            return method
+
+        def guarded(*args, **kwargs):
+            with self.breaker.guard(is_client_error):
+                return method(*args, **kwargs)
+        return guarded
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    The process-wide store for the configured STORAGE_BACKEND, created on first use.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if STORAGE_BACKEND == "supabase":
+                    _store = GuardedStore(SupabaseStore(), "supabase")
+                elif STORAGE_BACKEND == "sqlite":
+                    from app.sqlite_store import SQLiteStore
+                    _store = GuardedStore(SQLiteStore(SQLITE_PATH), "sqlite")
+                else:
+                    raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}. Options are: supabase, sqlite")
+    return _store
+
+
+store = LazyClient(get_store)
@@ -0,0 +1,146 @@
+import threading
+import time
+
+from app.members import MemberDirectory
+from app.slack_client import SlackClient
+
+
+class Tenant:
+    """
+    One coffee channel and the Slack workspace it belongs to. Channels in the same
+    workspace share that workspace's Slack client and member directory.
+    """
+
+    def __init__(self, team_id, channel_id, slack, members):
+        self.team_id = team_id
+        self.channel_id = channel_id
+        self.slack = slack
+        self.members = members
+
+    @property
+    def key(self):
+        # Fair scheduling is per floor, i.e. per coffee channel
+        return self.channel_id
+
+    def __repr__(self):
+        return f"Tenant(team_id={self.team_id!r}, channel_id={self.channel_id!r})"
+
+
+class TenantRegistry:
+    """
+    Resolves incoming requests to a tenant by `team_id` and `channel_id`.
+
+    `load()` returns (workspaces, channels): workspace rows carry team_id and
+    bot_token, channel rows carry channel_id, team_id and is_default. A request from
+    a registered coffee channel belongs to that channel; any other request (a DM, or
+    another channel) goes to its workspace's default coffee channel. Workspaces that
+    are not registered fall back to `default`, the tenant built from app/config.py,
+    so a single-workspace deployment needs no tenant rows at all.
+
+    The tables are loaded on first use. After that, once `ttl` seconds have passed,
+    they are reloaded on a background thread while requests keep resolving against
+    the copy already loaded. With `background=False` the reload runs in the request.
+    """
+
+    def __init__(self, default, load, ttl=300, background=True):
+        self.default = default
+        self.load = load
+        self.ttl = ttl
+        self.background = background
+        self.loaded_at = None
+        self._workspaces = {}
+        self._channels = {}
+        self._defaults = {}
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def is_stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl
+
+    def blocks(self):
+        """
+        True when the next lookup would load the tables on the caller's thread.
+        """
+        return self.is_stale() and (self.loaded_at is None or not self.background)
+
+    def _ensure_fresh(self):
+        if not self.is_stale():
+            return
+        if self.blocks():
+            self.refresh()
+            return
+
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, daemon=True, name="tenant-refresh").start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        finally:
+            self._refreshing = False
+
+    def refresh(self):
+        with self._lock:
+            if not self.is_stale():
+                return
+            # Mark as loaded first so a failing table is retried once per TTL, not per request
+            self.loaded_at = time.monotonic()
+
+            try:
+                workspaces, channels = self.load()
+            except Exception as e:
+                print(f"Failed to load tenants, using the configured workspace: {e}")
+                return
+
+            self._build(workspaces, channels)
+
+    def _build(self, workspaces, channels):
+        # Keep clients (and their pools and caches) for workspaces whose token is unchanged
+        clients = {}
+        for row in workspaces:
+            current = self._workspaces.get(row["team_id"])
+            if current is not None and current[0] == row["bot_token"]:
+                clients[row["team_id"]] = current
+            else:
+                slack = SlackClient(row["bot_token"])
+                clients[row["team_id"]] = (row["bot_token"], slack, MemberDirectory(slack))
+
+        tenants, defaults = {}, {}
+        for row in sorted(channels, key=lambda row: (not row.get("is_default"), row["channel_id"])):
+            workspace = clients.get(row["team_id"])
+            if workspace is None:
+                continue
+            tenant = Tenant(row["team_id"], row["channel_id"], workspace[1], workspace[2])
+            tenants[row["channel_id"]] = tenant
+            defaults.setdefault(row["team_id"], tenant)
+
+        self._workspaces, self._channels, self._defaults = clients, tenants, defaults
+
+    def resolve(self, team_id=None, channel_id=None):
+        self._ensure_fresh()
+
+        tenant = self._channels.get(channel_id)
+        if tenant is not None:
+            return tenant
+        return self._defaults.get(team_id, self.default)
+
+    def for_channel(self, channel_id):
+        """
+        The tenant that owns a coffee channel, for work that only knows the channel.
+        """
+        return self.resolve(channel_id=channel_id)
+
+    def member_directories(self):
+        """
+        (team_id, MemberDirectory) for the configured workspace and every registered one.
+        """
+        directories = [(self.default.team_id, self.default.members)]
+        directories += [(team_id, workspace[2]) for team_id, workspace in self._workspaces.items()]
+        return directories
+
+    def all(self):
+        self._ensure_fresh()
+        return list(self._channels.values()) or [self.default]
@@ -1,11 +1,64 @@
-import requests
-from app.config import SLACK_BOT_TOKEN, SUPABASE_SERVICE_KEY
-from supabase import create_client
-from app.config import SUPABASE_URL, SUPABASE_SERVICE_KEY
-from random import choice
+from app.storage import store
+from app.leaderboard import monthly_archive, counter_store, current_month, next_month, snapshot_rows
+from app.leaderboard import COUNTER_BOARDS, LEADERBOARD_LIMIT, WINNER_BOARDS
+from app.members import member_directory
+from app.selection import selected_today, selection_engine
+from app.slack_client import slack
+from app.accusations import open_accusations
+from app.scheduler import JobScheduler
+from app.write_buffer import WriteBuffer
+from app.idempotency import IdempotencyStore
+from app.outbox import Outbox
+from app.tenants import Tenant, TenantRegistry
+from app.metrics import metrics
+from app.config import COFFEE_CHANNEL_ID, WRITE_SPOOL_PATH, WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL, COFFEE_READY_DELAY_MINUTES
+from app.config import OUTBOX_WINDOW_SECONDS, OUTBOX_SENDERS, SUPPLY_ALERT_DAYS, BACKGROUND_WORKERS
 from datetime import datetime, timedelta
+from uuid import uuid4
 
-supabase = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+
+def insert_rows(table, rows):
+    """
+    Bulk insert rows into a table and return the stored rows. Rows that carry their own
+    id are upserted ignoring duplicates, so replaying the write spool is harmless.
+    """
+    return store.insert_rows(table, rows)
+
+
+write_buffer = WriteBuffer(
+    insert_rows, WRITE_SPOOL_PATH, WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL, background=BACKGROUND_WORKERS
+)
+
+
+def load_idempotent_response(key):
+    """
+    The response recorded for an idempotency key by any process, or None.
+    """
+    return store.idempotent_response(key)
+
+
+def save_idempotent_response(key, response):
+    # Buffered: Slack's first retry comes seconds later, well after the next flush
+    write_buffer.append("idempotency_keys", {
+        "id": key,
+        "response": response,
+        "created_at": datetime.utcnow().isoformat()
+    })
+
+
+idempotency_store = IdempotencyStore(load_idempotent_response, save_idempotent_response)
+
+LEADERBOARD_TYPES = [
+    "accused_leaderboard",
+    "accuser_leaderboard",
+    "brew_leaderboard",
+    "brew_leaderboard_all_time",
+    "restock_leaderboard",
+    "restock_leaderboard_all_time",
+    "last_cup_leaderboard",
+]
+
+MONTHLY_WINNER_VIEWS = list(WINNER_BOARDS)
 
 
 def log_brew(user_id, user_name, channel):
@@ -13,222 +66,372 @@ def log_brew(user_id, user_name, channel):
     Logs the brewing activity in the database and schedules a follow-up message.
     """
 
+    timestamp = datetime.utcnow()
+    brew_id = str(uuid4())
+
     # Log the brewing activity
-    supabase.table("brewing_logs").insert({
+    write_buffer.append("brewing_logs", {
+        "id": brew_id,
         "user_id": user_id,
         "user_name": user_name,
         "channel": channel,
-        "timestamp": datetime.utcnow().isoformat()  # Add a timestamp
-    }).execute()
+        "timestamp": timestamp.isoformat()  # Add a timestamp
+    })
+    counter_store.record("brew", timestamp, user_id, user_name)
+    selection_engine.record_brew(channel, user_id, timestamp)
+
+    # Schedule the "coffee is ready" follow-up
+    job = {
+        "id": str(uuid4()),
+        "brew_id": brew_id,
+        "execute_at": (timestamp + timedelta(minutes=COFFEE_READY_DELAY_MINUTES)).isoformat(),
+        "payload": {"text": "☕ Coffee is ready!", "channel": channel},
+        "channel": channel,
+        "status": "pending"
+    }
+    write_buffer.append("brewing_jobs", job)
+    if BACKGROUND_WORKERS:
+        brew_scheduler.schedule(job)
 
     print("Brewing activity logged and follow-up message scheduled.")
 
 
-def send_message(channel, text):
+def load_pending_brewing_jobs():
     """
-    Sends a message to the specified Slack channel.
+    Fetch follow-up jobs that have not been sent yet.
     """
-    url = "https://slack.com/api/chat.postMessage"
-    headers = {
-        "Authorization": f"Bearer {SLACK_BOT_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "channel": channel,
-        "text": text
-    }
-    response = requests.post(url, headers=headers, json=data)
-
-    if not response.ok:
-        print(f"Failed to send message: {response.text}")
+    write_buffer.flush()
+    return store.pending_brewing_jobs()
 
 
-def get_channel_users(channel_id):
+def claim_brewing_job(job_id):
     """
-    Fetch all non-bot users in a Slack channel.
+    Atomically move a job from pending to processing. Returns False if another
+    process has already claimed it.
     """
-    url = "https://slack.com/api/conversations.members"
-    headers = {
-        "Authorization": f"Bearer {SLACK_BOT_TOKEN}"
-    }
-    params = {"channel": channel_id}
-    response = requests.get(url, headers=headers, params=params).json()
+    write_buffer.flush()
+    return store.claim_brewing_job(job_id)
+
+
+def complete_brewing_job(job_id, ok):
+    store.finish_brewing_job(job_id, "processed" if ok else "failed")
 
+
+def run_brewing_job(job):
+    payload = job["payload"]
+    response = tenants.for_channel(payload["channel"]).slack.post_message(payload["channel"], payload["text"])
     if not response.get("ok"):
-        print(f"Error fetching channel members: {response}")
-        return []
+        raise RuntimeError(f"Failed to send follow-up message: {response}")
 
-    members = response.get("members", [])
-    non_bot_users = []
 
-    for user_id in members:
-        user_info = requests.get(
-            "https://slack.com/api/users.info",
-            headers=headers,
-            params={"user": user_id}
-        ).json()
+brew_scheduler = JobScheduler(load_pending_brewing_jobs, claim_brewing_job, run_brewing_job, complete_brewing_job)
 
-        if user_info.get("ok") and not user_info["user"]["is_bot"]:
-            user = user_info["user"]
-            non_bot_users.append({
-                "id": user["id"],
-                "name": user["name"],  # Slack username
-                "real_name": user.get("real_name")  # Display name
-            })
 
-    return non_bot_users
+@metrics.collector
+def brew_scheduler_metrics():
+    """
+    Queue size and firing lag of the "coffee is ready" follow-ups.
+    """
+    return brew_scheduler.metric_samples(job="coffee_ready")
 
 
-def pick_random_brewer(channel_id):
+def load_tenants():
     """
-    Pick a random user from the channel who has not been picked on the current day.
+    Returns the registered workspaces and their coffee channels.
     """
-    # Fetch all users in the channel
-    all_users = get_channel_users(channel_id)
+    return store.tenants()
+
+
+tenants = TenantRegistry(
+    Tenant(None, COFFEE_CHANNEL_ID, slack, member_directory), load_tenants, background=BACKGROUND_WORKERS
+)
+
+
+@metrics.collector
+def member_directory_metrics():
+    """
+    Cache hit/miss and refresh latency counters of each workspace's member directory.
+    """
+    for team_id, members in tenants.member_directories():
+        yield from members.metric_samples(team=team_id or "default")
+
+
+outbox = Outbox(OUTBOX_WINDOW_SECONDS, senders=OUTBOX_SENDERS, background=BACKGROUND_WORKERS)
+
+
+def send_message(channel, text, tenant=None):
+    """
+    Queues a message for the specified Slack channel. Messages sent to the same
+    channel in quick succession are posted together.
+    """
+    outbox.post((tenant or tenants.for_channel(channel)).slack, channel, text)
+
+
+def post_status(channel, text, tenant=None):
+    """
+    Shows an update in the channel's live coffee status message, which is edited
+    in place rather than posted again.
+    """
+    outbox.status((tenant or tenants.for_channel(channel)).slack, channel, text)
+
+
+def announce_supply_alerts(channel, tenant=None):
+    """
+    Warns the channel about any supply forecast to run out within SUPPLY_ALERT_DAYS.
+    Skipped without background workers, where /brew runs inline and the forecast's
+    year of history would be loaded before Slack gets its reply.
+    """
+    if not SUPPLY_ALERT_DAYS or not BACKGROUND_WORKERS:
+        return
 
-    # Get today's date
-    today = datetime.utcnow().date()
+    # NumPy is only loaded when alerts are turned on
+    from app.analytics import supply_forecaster, supply_message
+
+    try:
+        alerts = supply_forecaster.due_alerts()
+    except Exception as e:
+        print(f"Failed to forecast supplies: {e}")
+        return
+
+    for item, forecast in alerts:
+        send_message(channel, supply_message(item, forecast), tenant)
+
+
+def get_channel_users(channel_id, tenant=None):
+    """
+    Fetch all non-bot users in a Slack channel.
+    """
+    return (tenant or tenants.for_channel(channel_id)).members.get_channel_users(channel_id)
+
+
+def pick_random_brewer(channel_id, tenant=None):
+    """
+    Pick a user from the channel who has not been picked on the current day,
+    using the configured selection strategy.
+    """
+    # Fetch all users in the channel
+    members = (tenant or tenants.for_channel(channel_id)).members
+    all_users = members.get_channel_users(channel_id)
 
     # Fetch users who have been selected today
-    selected_today = supabase.table("selected_brewers")\
-        .select("user_id, timestamp")\
-        .eq("channel_id", channel_id)\
-        .execute()
+    selected_user_ids_today = selected_today.get(
+        channel_id, lambda start, end: fetch_selected_brewer_ids(channel_id, start, end)
+    )
 
-    selected_user_ids_today = {
-        row["user_id"] for row in selected_today.data if datetime.fromisoformat(row["timestamp"]).date() == today
-    }
+    if selection_engine.availability_is_stale():
+        load_brewer_availability()
+
+    return selection_engine.pick(
+        channel_id, all_users, selected_user_ids_today, lambda: fetch_brewer_stats(channel_id),
+        roster_version=members.roster_version(channel_id)
+    )
+
+
+def fetch_brewer_stats(channel_id):
+    """
+    Per-user brew counts and last brew/selection time for a channel, used to seed the selection engine.
+    """
+    return store.brewer_stats(channel_id)
+
+
+def load_brewer_availability():
+    """
+    Load opt-outs and availability windows into the selection engine.
+    """
+    selection_engine.load_availability(store.brewer_availability())
+
+
+def set_brewer_opt_out(user_id, opted_out):
+    """
+    Record whether a user wants to be left out of /pick-brewer.
+    """
+    store.set_brewer_opt_out(user_id, opted_out)
+    selection_engine.set_opted_out(user_id, opted_out)
 
-    # Filter eligible users
-    eligible_users = [user for user in all_users if user["id"] not in selected_user_ids_today]
 
-    return choice(eligible_users) if eligible_users else None
+def fetch_selected_brewer_ids(channel_id, start, end):
+    """
+    Fetch the IDs of users selected in a channel between two ISO timestamps.
+    Served by the selected_brewers (channel_id, timestamp) index.
+    """
+    return store.selected_brewer_ids(channel_id, start, end)
 
 
 def log_selected_brewer(user_id, user_name, channel_id):
     """
     Log the selected brewer in the database.
     """
-    supabase.table("selected_brewers").insert({
+    timestamp = datetime.utcnow()
+    write_buffer.append("selected_brewers", {
+        "id": str(uuid4()),
         "user_id": user_id,
         "user_name": user_name,
-        "channel_id": channel_id
-    }).execute()
+        "channel_id": channel_id,
+        "timestamp": timestamp.isoformat()
+    })
+    selected_today.add(channel_id, user_id)
+    selection_engine.record_selection(channel_id, user_id, timestamp)
 
 
 def log_last_cup(user_id, user_name, channel_id):
     """
-    Log the user who took the last cup of coffee into Supabase.
+    Log the user who took the last cup of coffee.
     """
-    supabase.table("last_cup_logs").insert({
+    timestamp = datetime.utcnow()
+    write_buffer.append("last_cup_logs", {
+        "id": str(uuid4()),
         "user_id": user_id,
         "user_name": user_name,
-        "channel_id": channel_id
-    }).execute()
+        "channel_id": channel_id,
+        "timestamp": timestamp.isoformat()
+    })
+    counter_store.record("last_cup", timestamp, user_id, user_name)
 
 
 def log_accusation(accuser_id, accuser_name, accused_id, accused_name, channel_id):
     """
-    Log an accusation into the Supabase database and return the generated accusation ID.
+    Log an accusation and return the generated accusation ID.
     """
-    result = supabase.table("accusations").insert({
+    timestamp = datetime.utcnow()
+    # Written synchronously because the caller needs the generated ID
+    stored = write_buffer.insert_now("accusations", {
         "accuser_id": accuser_id,
         "accuser_name": accuser_name,
         "accused_id": accused_id,
         "accused_name": accused_name,
         "channel_id": channel_id,
-        "timestamp": datetime.utcnow().isoformat()  # timestamp for filtering
-    }).execute()
+        "timestamp": timestamp.isoformat()  # timestamp for filtering
+    })
+    counter_store.record("accuser", timestamp, accuser_id, accuser_name)
+    counter_store.record("accused", timestamp, accused_id, accused_name)
+    open_accusations.opened(stored[0])
 
     # Return the accusation ID from the result
-    return result.data[0]["id"]
+    return stored[0]["id"]
 
 
-def get_leaderboard_data(leaderboard_type):
+def load_counter_store():
     """
-    Query Supabase for leaderboard data using predefined views or raw SQL.
+    Load the all-time and current-month leaderboard counters into the in-process store.
     """
-    if leaderboard_type == "accused_leaderboard":
-        query = "SELECT accused_name AS user_name, accusations AS count FROM public.acussed_leaderboard LIMIT 3;"
-
-    elif leaderboard_type == "accuser_leaderboard":
-        query = "SELECT accuser_name AS user_name, accusations_made AS count FROM public.acusser_leaderboard LIMIT 3;"
+    counter_store.load(store.leaderboard_counters(["all", current_month()]))
 
-    elif leaderboard_type == "brew_leaderboard":
-        query = "SELECT user_name, brew_count::INTEGER AS count FROM public.brew_leaderboard LIMIT 3;"
 
-    elif leaderboard_type == "brew_leaderboard_all_time":
-        query = """
-            SELECT user_name, COUNT(*)::INTEGER AS count
-            FROM brewing_logs
-            GROUP BY user_name
-            ORDER BY count DESC
-            LIMIT 3;
-        """
+def load_winner_snapshots(board):
+    """
+    The closed months' winners for a board, oldest first. Months that have finished
+    since the last snapshot are ranked and frozen into monthly_winner_snapshots first,
+    so each month's logs are only ranked once.
+    """
+    before = current_month()
+    snapshots = store.winner_snapshots(board)
+    start = next_month(snapshots[-1]["month"]) if snapshots else None
 
-    elif leaderboard_type == "restock_leaderboard":
-        query = "SELECT user_name, count FROM public.restock_leaderboard;"
+    if start is None or start < before:
+        rows = snapshot_rows(board, store.monthly_rankings(board, start, before))
+        if rows:
+            store.save_winner_snapshots(rows)
+            snapshots += rows
+    return snapshots
 
-    elif leaderboard_type == "restock_leaderboard_all_time":
-        query = """
-            SELECT user_name, SUM(points)::INTEGER AS count
-            FROM restock_logs
-            GROUP BY user_name
-            ORDER BY count DESC
-            LIMIT 3;
-        """
 
-    elif leaderboard_type == "last_cup_leaderboard":
-        query = "SELECT user_name, times_last_cup AS count FROM public.last_cup_leaderboard LIMIT 3;"
+def get_monthly_winners(view):
+    """
+    Closed months come from the snapshot archive and the current month from the
+    in-process counters. The live view is the fallback if the archive can't be read.
+    """
+    board = WINNER_BOARDS[view]
+    try:
+        closed = monthly_archive.get(board, load_winner_snapshots)
+    except Exception as e:
+        print(f"Failed to load monthly winner snapshots, falling back to {view}: {e}")
+        return store.monthly_winners(view)
 
-    elif leaderboard_type == "brewer_monthly_winners":
-        response = supabase.table("brewer_monthly_winners").select("month_name, summary").order("month").execute()
-        return response.data if response.data else []
+    try:
+        if counter_store.is_stale():
+            load_counter_store()
+    except Exception as e:
+        print(f"Failed to reload leaderboard counters, serving the last loaded ones: {e}")
 
-    elif leaderboard_type == "restock_monthly_winners":
-        response = supabase.table("restock_monthly_winners").select("month_name, summary").order("month").execute()
-        return response.data if response.data else []
+    current = counter_store.current_winners(board)
+    return closed + [current] if current else closed
 
-    else:
-        return []
 
-    # Execute the query using Supabase RPC
-    response = supabase.rpc("execute_raw_sql", {"sql": query}).execute()
+def get_leaderboard_data(leaderboard_type):
+    """
+    Read leaderboard data from the in-process rollup counters, or the monthly winners.
+    The counters are reloaded from the store when stale; a direct query is the fallback if that fails.
+    """
+    if leaderboard_type in MONTHLY_WINNER_VIEWS:
+        return get_monthly_winners(leaderboard_type)
 
-    # Log and handle errors
-    print(f"Supabase RPC Response: {response}")
-    if not response.data:
-        print(f"Supabase RPC Error: {response}")
+    if leaderboard_type not in COUNTER_BOARDS:
         return []
 
-    return response.data
+    try:
+        if counter_store.is_stale():
+            load_counter_store()
+    except Exception as e:
+        if counter_store.loaded_at is None:
+            print(f"Failed to load leaderboard counters, falling back to a direct query: {e}")
+            return store.leaderboard(leaderboard_type, LEADERBOARD_LIMIT)
+        # Stale counters beat no leaderboard while the database is unavailable
+        print(f"Failed to reload leaderboard counters, serving the last loaded ones: {e}")
+
+    board, period = COUNTER_BOARDS[leaderboard_type]
+    return counter_store.top(board, period, LEADERBOARD_LIMIT)
 
 
-def log_refutation(accusation_id, channel_id):
+def refute_latest_accusation(channel_id):
     """
-    Logs a refutation anonymously into the Supabase database using the accusation ID.
+    Anonymously refutes the channel's most recent open accusation from the past 24 hours.
+    Returns the accusation, or None if there is nothing to refute.
     """
-    # Fetch accusation details from the database
-    accusation = supabase.table("accusations").select("*").eq("id", accusation_id).execute()
+    since = (datetime.utcnow() - timedelta(hours=24)).isoformat()
+    known, accusation = open_accusations.latest(channel_id, since)
+    if known and accusation is None:
+        return None
 
-    if not accusation.data:
-        raise ValueError(f"Accusation with ID {accusation_id} not found.")
+    accusation = store.refute_latest_accusation(channel_id, since)
+    open_accusations.refuted(channel_id, accusation)
+    return accusation
 
-    accused_id = accusation.data[0]["accused_id"]
-    accused_name = accusation.data[0]["accused_name"]
 
-    # Insert the refutation record
-    result = supabase.table("refutations").insert({
-        "accusation_id": accusation_id,
-        "accused_id": accused_id,
-        "accused_name": accused_name,
-        "channel_id": channel_id,
+def log_vote(accusation_id, voter_id, voter_name, vote):
+    """
+    Record a vote on an accusation. Returns "recorded", "duplicate" if the voter has
+    already voted on it, or "unknown" if there is no such accusation.
+    """
+    if open_accusations.has_voted(accusation_id, voter_id):
+        return "duplicate"
+
+    status = store.cast_vote({
+        "accusation_id": accusation_id,  # Keep as UUID (string)
+        "voter_id": voter_id,
+        "voter_name": voter_name,
+        "vote": vote,
         "timestamp": datetime.utcnow().isoformat()
-    }).execute()
+    })
+    if status != "unknown":
+        open_accusations.voted(accusation_id, voter_id)
+    return status
+
 
-    if not result.data:
-        raise ValueError("Failed to log refutation: No data returned from the database.")
-    return result.data[0]["id"]
+def close_accusation(accusation_id):
+    """
+    Tally an accusation's votes and record the verdict. Returns the tally (see
+    Store.close_accusation), or None if there is no such accusation.
+    """
+    closed = store.close_accusation(accusation_id)
+    if closed and (closed["accept"] or closed["reject"]):
+        open_accusations.closed(accusation_id, closed["channel_id"])
+        # A dismissed accusation no longer counts against the accused, and an upheld one counts again
+        if closed["flipped"]:
+            counter_store.record(
+                "accused", closed["timestamp"], closed["accused_id"], closed["accused_name"],
+                -1 if closed["refuted"] else 1
+            )
+    return closed
 
 
 def log_restock(user_id, user_name, item, quantity):
@@ -244,15 +447,21 @@ def log_restock(user_id, user_name, item, quantity):
         raise ValueError(f"Unknown item type: {item}")
 
     points = item_points[item] * quantity
+    timestamp = datetime.utcnow()
 
-    supabase.table("restock_logs").insert({
+    write_buffer.append("restock_logs", {
+        "id": str(uuid4()),
         "user_id": user_id,
         "user_name": user_name,
         "item": item,
         "quantity": quantity,
         "points": points,
-        "timestamp": datetime.utcnow().isoformat()
-    }).execute()
+        "timestamp": timestamp.isoformat()
+    })
+    counter_store.record("restock", timestamp, user_id, user_name, points)
+    if SUPPLY_ALERT_DAYS:
+        from app.analytics import supply_forecaster
+        supply_forecaster.invalidate()
 
     return points
 
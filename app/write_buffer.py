@@ -0,0 +1,260 @@
+import atexit
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+
+from app.resilience import CircuitOpenError
+
+# A row that fails on its own this many times, while other inserts succeed, is dead-lettered
+MAX_ROW_ATTEMPTS = 3
+
+# Longest wait between retries of a table whose flush keeps failing
+MAX_RETRY_SECONDS = 300
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer for log inserts. Rows are appended to a local spool file and
+    queued per table, then flushed as one bulk insert per table when a table reaches
+    `max_batch` rows or every `flush_interval` seconds. Rows left in the spool by a
+    crash are replayed on start-up, so `insert_rows` must be idempotent (rows carry
+    their own primary key).
+
+    Each process spools to `<spool_path>.<pid>` and holds a lock on it while running.
+    On start-up a process adopts the spools of processes that are no longer running.
+
+    A failed batch is split in halves until the rows that fail on their own are
+    found. A table keeps being retried with exponential backoff. A row that keeps
+    failing while other inserts succeed is moved to `<spool_path>.dead.jsonl`, so it
+    can't hold up the rest of its table. While nothing inserts (the database is down)
+    rows are only retried.
+
+    With `background=False` there is no spool or flush thread: `append` inserts the
+    row before returning, for processes that are frozen between requests.
+    """
+
+    def __init__(self, insert_rows, spool_path, max_batch=50, flush_interval=1.0, background=True):
+        self.insert_rows = insert_rows
+        self.spool_base = spool_path
+        self.spool_path = None
+        self.dead_letter_path = f"{spool_path}.dead.jsonl"
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.background = background
+        self._pending = {}
+        self._failures = {}  # table -> consecutive failed flushes
+        self._retry_at = {}  # table -> monotonic time of its next flush
+        self._row_attempts = {}  # (table, row id) -> (failed inserts, self._inserts at the last one)
+        self._inserts = 0  # successful insert calls, to tell a bad row from a database outage
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._spool = None
+        self._owner_lock = None
+        self._thread = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            # Chosen at start-up rather than import, so forked workers each get their own
+            self.spool_path = f"{self.spool_base}.{os.getpid()}"
+            self._owner_lock = open(f"{self.spool_path}.lock", "w")
+            fcntl.flock(self._owner_lock, fcntl.LOCK_EX)
+
+            with open(f"{self.spool_base}.lock", "w") as recovery_lock:
+                # One process at a time adopts orphaned spools, so no rows are adopted twice
+                fcntl.flock(recovery_lock, fcntl.LOCK_EX)
+                orphans = self._recover()
+                # Start from a clean spool so a torn final line can't swallow the next append
+                self._write_spool()
+                for path in orphans:
+                    if path != self.spool_path:
+                        os.remove(path)
+
+            self._thread = threading.Thread(target=self._run, daemon=True, name="write-buffer")
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def _orphaned_spools(self):
+        """
+        Spools whose process has exited: the legacy shared spool, per-process spools
+        whose lock nobody holds, and a spool already at our own path, left by a crashed
+        process that had the same PID (e.g. PID 1 in a restarted container). Stale lock
+        files are removed.
+        """
+        orphans = [path for path in (self.spool_base, self.spool_path) if os.path.exists(path)]
+        for lock_path in glob.glob(f"{glob.escape(self.spool_base)}.*.lock"):
+            spool = lock_path[:-len(".lock")]
+            if spool == self.spool_path:
+                continue
+            with open(lock_path, "a") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # still running
+                os.remove(lock_path)
+            if os.path.exists(spool):
+                orphans.append(spool)
+        return orphans
+
+    def _recover(self):
+        orphans = self._orphaned_spools()
+        for path in orphans:
+            with open(path, encoding="utf-8") as spool:
+                for line in spool:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # torn final line from a crash mid-write
+                    self._pending.setdefault(entry["table"], []).append(entry["row"])
+
+        if self._pending:
+            print(f"Recovered {sum(map(len, self._pending.values()))} buffered rows from {len(orphans)} spools")
+        return orphans
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Buffered write flush failed: {e}")
+
+    def append(self, table, row):
+        """
+        Queue a row for `table`. It is durable in the spool before this returns.
+        """
+        if not self.background:
+            self.insert_rows(table, [row])
+            return
+
+        if self._thread is None:
+            self._start()
+
+        with self._lock:
+            self._spool.write(json.dumps({"table": table, "row": row}) + "\n")
+            self._spool.flush()
+            os.fsync(self._spool.fileno())
+            rows = self._pending.setdefault(table, [])
+            rows.append(row)
+            full = len(rows) >= self.max_batch
+
+        if full:
+            self._wake.set()
+
+    def insert_now(self, table, row):
+        """
+        Insert a row synchronously, for callers that need the stored row back
+        (e.g. its generated ID). Anything already queued is flushed first so
+        writes reach the database in order.
+        """
+        if self.pending_count():
+            self.flush()
+        return self.insert_rows(table, [row])
+
+    def flush(self):
+        """
+        Bulk insert everything queued. Rows that fail stay queued for a later flush,
+        unless they have failed too often on their own.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batches, self._pending = self._pending, {}
+
+            now = time.monotonic()
+            for table, rows in batches.items():
+                if self._retry_at.get(table, 0) > now:
+                    self._keep(table, rows)
+                    continue
+
+                inserts = self._inserts
+                failed = self._insert(table, rows)
+                if failed:
+                    self._failed(table, inserts, failed)
+                else:
+                    self._failures.pop(table, None)
+                    self._row_attempts = {key: value for key, value in self._row_attempts.items() if key[0] != table}
+                    self._retry_at.pop(table, None)
+
+            self._rewrite_spool()
+
+    def _insert(self, table, rows):
+        """
+        Insert rows, splitting a failed batch in halves to find the rows that fail on
+        their own. Returns the (row, error) pairs that failed.
+        """
+        try:
+            self.insert_rows(table, rows)
+            self._inserts += 1
+            return []
+        except Exception as e:
+            if len(rows) == 1 or isinstance(e, CircuitOpenError):
+                return [(row, e) for row in rows]
+
+        middle = len(rows) // 2
+        return self._insert(table, rows[:middle]) + self._insert(table, rows[middle:])
+
+    def _failed(self, table, inserts, failed):
+        keep, dead = [], []
+        for row, error in failed:
+            key = (table, row.get("id"))
+            attempts, seen = self._row_attempts.get(key, (0, inserts))
+            # Only blame the row itself if some other insert has succeeded since its last failure
+            if self._inserts > seen and not isinstance(error, CircuitOpenError):
+                attempts += 1
+                if attempts >= MAX_ROW_ATTEMPTS:
+                    self._row_attempts.pop(key, None)
+                    dead.append((row, error))
+                    continue
+            self._row_attempts[key] = (attempts, self._inserts)
+            keep.append(row)
+
+        if dead:
+            self._dead_letter(table, dead)
+        if keep:
+            failures = self._failures[table] = self._failures.get(table, 0) + 1
+            delay = min(self.flush_interval * 2 ** failures, MAX_RETRY_SECONDS)
+            self._retry_at[table] = time.monotonic() + delay
+            print(f"Failed to flush {len(keep)} rows into {table}, retrying in {delay:.0f}s: {failed[0][1]}")
+            self._keep(table, keep)
+
+    def _keep(self, table, rows):
+        with self._lock:
+            self._pending[table] = rows + self._pending.get(table, [])
+
+    def _dead_letter(self, table, dead):
+        with open(self.dead_letter_path, "a", encoding="utf-8") as dead_letters:
+            for row, error in dead:
+                dead_letters.write(json.dumps({"table": table, "row": row, "error": str(error)}) + "\n")
+        print(f"Moved {len(dead)} rows that keep failing to insert into {table} to {self.dead_letter_path}")
+
+    def _rewrite_spool(self):
+        """
+        Replace the spool with only the rows still queued.
+        """
+        if self._spool is None:
+            return
+
+        with self._lock:
+            self._spool.close()
+            self._write_spool()
+
+    def _write_spool(self):
+        temp_path = f"{self.spool_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as temp:
+            for table, rows in self._pending.items():
+                for row in rows:
+                    temp.write(json.dumps({"table": table, "row": row}) + "\n")
+            temp.flush()
+            os.fsync(temp.fileno())
+        os.replace(temp_path, self.spool_path)
+        self._spool = open(self.spool_path, "a", encoding="utf-8")
+
+    def pending_count(self):
+        with self._lock:
+            return sum(map(len, self._pending.values()))
@@ -0,0 +1,88 @@
+"""
+Compares the cost of the "already picked today" lookup in pick_random_brewer as the
+selected_brewers history grows. Uses an in-memory SQLite table with the same
+(channel_id, timestamp) index as supabase_setup.sql, so it runs offline.
+
+    python benchmarks/selected_today.py --days 1 100 1000 --picks-per-day 5
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.selection import SelectedToday, utc_day_bounds  # noqa: E402
+
+CHANNEL_ID = "C0FFEE"
+
+
+def seed(days, picks_per_day, channels):
+    db = sqlite3.connect(":memory:")
+    db.execute("CREATE TABLE selected_brewers (user_id TEXT, user_name TEXT, channel_id TEXT, timestamp TEXT)")
+    db.execute("CREATE INDEX selected_brewers_channel_timestamp_idx ON selected_brewers (channel_id, timestamp)")
+
+    now = datetime.utcnow()
+    rows = []
+    for day in range(days):
+        for pick in range(picks_per_day):
+            timestamp = (now - timedelta(days=day, minutes=pick)).isoformat()
+            for channel in range(channels):
+                user_id = f"U{(day * picks_per_day + pick) % 400:04d}"
+                rows.append((user_id, user_id.lower(), f"{CHANNEL_ID}{channel or ''}", timestamp))
+    db.executemany("INSERT INTO selected_brewers VALUES (?, ?, ?, ?)", rows)
+    return db
+
+
+def legacy_lookup(db):
+    """
+    The original path: every row for the channel, filtered to today in Python.
+    """
+    today = datetime.utcnow().date()
+    rows = db.execute("SELECT user_id, timestamp FROM selected_brewers WHERE channel_id = ?", (CHANNEL_ID,))
+    return {user_id for user_id, timestamp in rows if datetime.fromisoformat(timestamp).date() == today}
+
+
+def indexed_lookup(db, start, end):
+    rows = db.execute(
+        "SELECT user_id FROM selected_brewers WHERE channel_id = ? AND timestamp >= ? AND timestamp < ?",
+        (CHANNEL_ID, start, end)
+    )
+    return [user_id for user_id, in rows]
+
+
+def timed(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--picks-per-day", type=int, default=5)
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'days':>6} {'rows':>8} {'legacy µs':>12} {'indexed µs':>12} {'cached µs':>12}")
+    for days in args.days:
+        db = seed(days, args.picks_per_day, args.channels)
+        rows = db.execute("SELECT COUNT(*) FROM selected_brewers").fetchone()[0]
+
+        start, end = utc_day_bounds(datetime.utcnow().date())
+        cache = SelectedToday()
+        assert set(indexed_lookup(db, start, end)) == legacy_lookup(db)
+        cache.get(CHANNEL_ID, lambda s, e: indexed_lookup(db, s, e))
+
+        legacy = timed(lambda: legacy_lookup(db), args.repeat)
+        indexed = timed(lambda: indexed_lookup(db, start, end), args.repeat)
+        cached = timed(lambda: cache.get(CHANNEL_ID, lambda s, e: indexed_lookup(db, s, e)), args.repeat)
+        print(f"{days:>6} {rows:>8} {legacy:>12.1f} {indexed:>12.1f} {cached:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
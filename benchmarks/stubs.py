@@ -0,0 +1,387 @@
+"""
+Local stand-ins for external services, used by the benchmarks so they run offline.
+"""
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import parse_qsl
+from uuid import uuid4
+
+import uvicorn
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_json(send, payload, status=200):
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class SlackStub:
+    """
+    Slack Web API stand-in. Every method answers {"ok": true} after `latency` seconds;
+    conversations.members, users.list and users.info serve a channel of `members`
+    users. Requests to /response/<id> are treated as response_url deliveries and
+    their arrival times are kept in `responses`.
+    """
+
+    def __init__(self, latency=0.2, members=50, page_size=200):
+        self.latency = latency
+        self.page_size = page_size
+        self.calls = 0
+        self.methods = {}
+        self.responses = {}
+        self.users = [self.user(f"U{i:06d}") for i in range(members)]
+
+    @staticmethod
+    def user(user_id):
+        name = f"user{user_id[1:]}"
+        return {
+            "id": user_id, "name": name, "real_name": name.title(), "is_bot": False, "deleted": False,
+            "profile": {"real_name": name.title(), "display_name": name},
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = await read_body(receive)
+
+        self.calls += 1
+        path = scope["path"]
+        await asyncio.sleep(self.latency)
+
+        if path.startswith("/response/"):
+            self.responses[path.rsplit("/", 1)[-1]] = time.perf_counter()
+            return await send_json(send, {"ok": True})
+
+        method = path.rsplit("/", 1)[-1]
+        self.methods[method] = self.methods.get(method, 0) + 1
+        params = dict(parse_qsl(scope["query_string"].decode()))
+        if body and dict(scope["headers"]).get(b"content-type", b"").startswith(b"application/json"):
+            params.update(json.loads(body))
+
+        if method == "conversations.members":
+            page, cursor = self.page(params)
+            return await send_json(send, {"ok": True, "members": [u["id"] for u in page], **cursor})
+        if method == "users.list":
+            page, cursor = self.page(params)
+            return await send_json(send, {"ok": True, "members": page, **cursor})
+        if method == "users.info":
+            return await send_json(send, {"ok": True, "user": self.user(params.get("user", "U000000"))})
+
+        await send_json(send, {"ok": True, "ts": f"{time.time():.6f}"})
+
+    def page(self, params):
+        start = int(params.get("cursor") or 0)
+        end = start + min(int(params.get("limit") or self.page_size), self.page_size)
+        cursor = {"response_metadata": {"next_cursor": str(end) if end < len(self.users) else ""}}
+        return self.users[start:end], cursor
+
+
+class PostgrestStub:
+    """
+    In-memory stand-in for Supabase's PostgREST API. Tables are lists of row dicts.
+    It supports the subset the app uses: select, eq/neq/gt/gte/lt/lte/in/is filters,
+    not and or/and trees, order, limit/offset, insert, upsert (on_conflict, ignore or merge duplicates),
+    PATCH updates, and the RPCs in `rpcs`. Every response waits `latency` seconds.
+    """
+
+    def __init__(self, latency=0.02, tables=None, rpcs=None):
+        self.latency = latency
+        self.tables = tables or {}
+        self.rpcs = dict(DEFAULT_RPCS, **(rpcs or {}))
+        self.calls = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = await read_body(receive)
+
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+
+        name = scope["path"].split("/rest/v1/", 1)[-1]
+        params = parse_qsl(scope["query_string"].decode())
+        headers = {key.decode().lower(): value.decode() for key, value in scope["headers"]}
+        payload = json.loads(body) if body else None
+
+        if name.startswith("rpc/"):
+            rpc = self.rpcs.get(name[4:])
+            if rpc is None:
+                return await send_json(send, {"message": f"function {name[4:]} not found"}, status=404)
+            result = rpc(self, payload or {})
+            # RPC results can be ordered and paged like a table
+            return await send_json(send, self.select(result, params) if isinstance(result, list) else result)
+
+        rows = self.tables.setdefault(name, [])
+        if scope["method"] == "GET":
+            return await send_json(send, self.select(rows, params))
+        if scope["method"] == "POST":
+            return await send_json(send, self.insert(rows, payload, dict(params), headers.get("prefer", "")), status=201)
+        if scope["method"] == "PATCH":
+            matched = [row for row in rows if self.matches(row, params)]
+            for row in matched:
+                row.update(payload)
+            return await send_json(send, matched)
+        if scope["method"] == "DELETE":
+            matched = [row for row in rows if self.matches(row, params)]
+            self.tables[name] = [row for row in rows if row not in matched]
+            return await send_json(send, matched)
+
+        await send_json(send, {"message": "unsupported"}, status=405)
+
+    def select(self, rows, params):
+        options = dict(params)
+        result = [row for row in rows if self.matches(row, params)]
+
+        for term in reversed((options.get("order") or "").split(",")):
+            if term:
+                column, _, direction = term.partition(".")
+                result.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse="desc" in direction)
+
+        offset = int(options.get("offset", 0))
+        limit = options.get("limit")
+        result = result[offset:offset + int(limit) if limit is not None else None]
+
+        columns = options.get("select", "*")
+        if columns != "*":
+            keys = [column.strip() for column in columns.split(",")]
+            result = [{key: row.get(key) for key in keys} for row in result]
+        return result
+
+    def insert(self, rows, payload, options, prefer):
+        new_rows = payload if isinstance(payload, list) else [payload]
+        keys = options.get("on_conflict", "id").split(",")
+        upsert = "resolution=" in prefer
+        existing = {tuple(row.get(key) for key in keys): row for row in rows} if upsert else {}
+
+        stored = []
+        for row in new_rows:
+            row = dict(row)
+            row.setdefault("id", str(uuid4()))
+            current = existing.get(tuple(row.get(key) for key in keys))
+            if current is not None:
+                if "merge-duplicates" in prefer:
+                    current.update(row)
+                    stored.append(current)
+                continue  # ignore-duplicates returns only the rows it inserted
+            rows.append(row)
+            existing[tuple(row.get(key) for key in keys)] = row
+            stored.append(row)
+        return stored
+
+    @staticmethod
+    def matches(row, params):
+        for column, condition in params:
+            if column in NON_FILTER_PARAMS:
+                continue
+            if column in ("or", "and"):
+                if not _logic(row, column, condition):
+                    return False
+                continue
+            op, _, arg = condition.partition(".")
+            if not _compare(row.get(column), op, arg):
+                return False
+        return True
+
+
+NON_FILTER_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+def _split_terms(text):
+    terms, depth, quoted, start = [], 0, False, 0
+    for index, char in enumerate(text):
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char in "()":
+            depth += 1 if char == "(" else -1
+        elif not quoted and not depth and char == ",":
+            terms.append(text[start:index])
+            start = index + 1
+    terms.append(text[start:])
+    return terms
+
+
+def _logic(row, op, condition):
+    results = []
+    for term in _split_terms(condition[1:-1]):
+        if term.startswith(("and(", "or(")):
+            inner, _, rest = term.partition("(")
+            results.append(_logic(row, inner, "(" + rest))
+        else:
+            column, _, test = term.partition(".")
+            test_op, _, arg = test.partition(".")
+            results.append(_compare(row.get(column), test_op, arg.strip('"')))
+    return all(results) if op == "and" else any(results)
+
+
+def _compare(value, op, arg):
+    if op == "not":
+        op, _, arg = arg.partition(".")
+        return not _compare(value, op, arg)
+    if isinstance(value, bool) or value is None:
+        value = "null" if value is None else str(value).lower()
+    if op == "is":
+        return str(value) == arg
+    if op == "in":
+        return str(value) in [item.strip('"') for item in arg.strip("()").split(",")]
+
+    left, right = value, arg
+    try:
+        left, right = float(value), float(arg)
+    except (TypeError, ValueError):
+        left = str(value)
+    return {
+        "eq": left == right, "neq": left != right,
+        "gt": left > right, "gte": left >= right,
+        "lt": left < right, "lte": left <= right,
+    }[op]
+
+
+def _brewer_stats(stub, params):
+    stats = {}
+    events = [(row, "brew") for row in stub.tables.get("brewing_logs", []) if row.get("channel") == params["p_channel_id"]]
+    events += [(row, "selected") for row in stub.tables.get("selected_brewers", []) if row.get("channel_id") == params["p_channel_id"]]
+    for row, kind in events:
+        entry = stats.setdefault(row["user_id"], {"user_id": row["user_id"], "brews": 0, "last_active": row["timestamp"]})
+        entry["brews"] += kind == "brew"
+        entry["last_active"] = max(entry["last_active"], row["timestamp"])
+    return list(stats.values())
+
+
+def _accusation(stub, accusation_id):
+    return next((row for row in stub.tables.get("accusations", []) if row["id"] == accusation_id), None)
+
+
+def _refute_latest_accusation(stub, params):
+    open_accusations = [
+        row for row in stub.tables.get("accusations", [])
+        if row["channel_id"] == params["p_channel_id"] and row["timestamp"] >= params["p_since"] and not row.get("judged")
+    ]
+    if not open_accusations:
+        return []
+    target = max(open_accusations, key=lambda row: row["timestamp"])
+    stub.tables.setdefault("refutations", []).append({
+        "id": len(stub.tables.get("refutations", [])) + 1, "accusation_id": target["id"],
+        "accused_id": target["accused_id"], "accused_name": target["accused_name"],
+        "channel_id": params["p_channel_id"], "timestamp": params["p_timestamp"],
+    })
+    return [target]
+
+
+def _cast_vote(stub, params):
+    if _accusation(stub, params["p_accusation_id"]) is None:
+        return "unknown"
+    votes = stub.tables.setdefault("votes", [])
+    if any(row["accusation_id"] == params["p_accusation_id"] and row["voter_id"] == params["p_voter_id"] for row in votes):
+        return "duplicate"
+    votes.append(dict({key[2:]: value for key, value in params.items()}, id=len(votes) + 1))
+    return "recorded"
+
+
+def _close_accusation(stub, params):
+    target = _accusation(stub, params["p_accusation_id"])
+    if target is None:
+        return []
+    votes = [row["vote"] for row in stub.tables.get("votes", []) if row["accusation_id"] == target["id"]]
+    accept, reject = votes.count("accept"), votes.count("reject")
+    before = bool(target.get("refuted"))
+    if votes:
+        target.update(judged=True, refuted=reject > accept)
+    return [{
+        "accused_id": target["accused_id"], "accused_name": target["accused_name"],
+        "channel_id": target["channel_id"], "timestamp": target["timestamp"],
+        "accept": accept, "reject": reject, "refuted": bool(target.get("refuted")),
+        "flipped": bool(target.get("refuted")) != before,
+    }]
+
+
+def _get_leaderboard(stub, params):
+    rows = [row for row in stub.tables.get("leaderboard_counters", []) if row["period"] == "all"]
+    rows.sort(key=lambda row: -row["count"])
+    return [{"user_name": row["user_name"], "count": row["count"]} for row in rows[:params.get("row_limit", 3)]]
+
+
+def _monthly_rankings(stub, params):
+    table, amount = {"brew": ("brewing_logs", None), "restock": ("restock_logs", "points")}[params["p_board"]]
+    totals = {}
+    for row in stub.tables.get(table, []):
+        if params["p_start"] and row["timestamp"] < params["p_start"] or row["timestamp"] >= params["p_end"]:
+            continue
+        key = (row["timestamp"][:7], row["user_name"])
+        totals[key] = totals.get(key, 0) + (row[amount] if amount else 1)
+
+    rows = []
+    for (month, user_name), count in totals.items():
+        rank = 1 + sum(1 for (other, _), other_count in totals.items() if other == month and other_count > count)
+        if rank <= params.get("p_ranks", 10):
+            rows.append({"month": month, "user_name": user_name, "count": count, "rank": rank})
+    return rows
+
+
+DEFAULT_RPCS = {
+    "get_brewer_stats": _brewer_stats,
+    "refute_latest_accusation": _refute_latest_accusation,
+    "cast_vote": _cast_vote,
+    "close_accusation": _close_accusation,
+    "get_leaderboard": _get_leaderboard,
+    "rebuild_leaderboard_counters": lambda stub, params: None,
+    "monthly_rankings": _monthly_rankings,
+}
+
+
+def serve_in_thread(app, port):
+    """
+    Run an ASGI app with uvicorn on a daemon thread and wait until it accepts connections.
+    """
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+def start_app(code, port, env):
+    """
+    Run the app server given by the Python snippet `code` in a subprocess and wait
+    until it answers on `port`.
+    """
+    process = subprocess.Popen(
+        [sys.executable, "-c", code.format(port=port)],
+        cwd=ROOT, env=dict(os.environ, **env), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"app server on port {port} did not start")
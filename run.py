@@ -1,7 +1,16 @@
-from flask import Flask, request, jsonify
+import hmac
+
+from flask import Flask, Response, request, jsonify
+from app import metrics
+from app.config import BACKGROUND_WORKERS, EXPORT_TOKEN, METRICS_TOKEN
+from app.export import export_table, EXPORT_FORMATS
+from app.deferred import executor
+from app.resilience import breaker_status
 from app.routes import routes
+from app.utils import brew_scheduler, outbox, write_buffer
 
 app = Flask(__name__)
+metrics.init_app(app)
 
 # Register blueprints or routes
 app.register_blueprint(routes)
@@ -12,5 +21,75 @@ def index():
     return "Slack Bot is running!", 200
 
 
+def authorized():
+    return not METRICS_TOKEN or hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"
+    )
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    if not authorized():
+        return jsonify({"error": "unauthorized"}), 401
+
+    return metrics.metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+
+@app.route("/status")
+def status():
+    """
+    Circuit breaker states and how much work is queued while a dependency is down.
+    Responds 503 while any circuit is open.
+    """
+    if not authorized():
+        return jsonify({"error": "unauthorized"}), 401
+
+    breakers = breaker_status()
+    degraded = any(item["state"] != "closed" for item in breakers.values())
+    return jsonify({
+        "status": "degraded" if degraded else "ok",
+        "breakers": breakers,
+        "queued": {
+            "log_writes": write_buffer.pending_count(),
+            "messages": outbox.pending_count(),
+            "deferred_commands": executor.queue_depth(),
+            "scheduled_jobs": brew_scheduler.stats()["pending"],
+        },
+    }), 503 if degraded else 200
+
+
+@app.route("/export/<table>")
+def export(table):
+    """
+    Streams an activity log table as CSV or Parquet, e.g.
+    /export/restock_logs?since=2025-01-01&until=2026-01-01&format=csv
+    """
+    if not EXPORT_TOKEN:
+        return jsonify({"error": "export is disabled, set EXPORT_TOKEN to enable it"}), 404
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {EXPORT_TOKEN}"):
+        return jsonify({"error": "unauthorized"}), 401
+
+    fmt = request.args.get("format", "csv")
+    try:
+        chunks = export_table(
+            table, fmt, request.args.get("since"), request.args.get("until"), request.args.get("channel")
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 501
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    return Response(chunks, mimetype=mimetype, headers={
+        "Content-Disposition": f"attachment; filename={table}.{extension}"
+    })
+
+
+# Fire pending "coffee is ready" follow-ups from this process. Without background
+# workers the process_brewing_jobs cron job in Supabase sends them instead.
+if BACKGROUND_WORKERS:
+    brew_scheduler.start()
+
+
 if __name__ == "__main__":
     app.run(debug=True)